@@ -0,0 +1,230 @@
+"""Headless benchmark suite for smb14k.
+
+Loads every (world, level) pair, drives it with a scripted runner under a
+dummy video driver and reports per level:
+
+- gen_ms: generate_level time (best of several runs)
+- load_ms: time to instantiate the level from its compiled form, as
+  load_level does on every (re)spawn
+- ticks_per_sec: Simulation.step throughput
+- frames_per_sec: world + HUD render and flip throughput
+- peak_kb: peak Python memory while building and simulating the level
+
+Besides the normal levels it runs scaled-up variants (10x, 100x and 1000x
+wider levels, 10x and 100x the enemies) so that costs which grow with level
+size show up. --streaming generates the levels chunk by chunk with
+LevelStream instead; gen_ms and load_ms then time one chunk and the initial
+load_level. --enemy-physics numpy runs the enemies on the batched backend in
+smb_batch (needs NumPy). --step-ticks N advances the simulation N ticks per
+Simulation.step call, using the coarse collision pass; completed counts how
+often the scripted runner finished the level, so a collision bug that
+strands or kills the player shows up next to the speedup.
+Results are written as JSON; pass --baseline with an earlier result file to
+flag metrics that regressed by more than --tolerance.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json
+"""
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import pygame
+
+import smb14k
+
+# name: (width_scale, enemy_scale)
+VARIANTS = {
+    'base': (1, 1),
+    'wide10': (10, 1),
+    'wide100': (100, 1),
+    'wide1000': (1000, 1),
+    'enemies10': (1, 10),
+    'enemies100': (1, 100),
+}
+
+# Whether a larger value of the metric is better
+METRICS = {
+    'gen_ms': False,
+    'load_ms': False,
+    'ticks_per_sec': True,
+    'frames_per_sec': True,
+    'peak_kb': False,
+}
+
+def scripted_inputs(sim):
+    """Run right and jump whenever the player lands"""
+    inputs = smb14k.INPUT_RIGHT | smb14k.INPUT_JUMP_HELD
+    if sim.player.on_ground:
+        inputs |= smb14k.INPUT_JUMP
+    return inputs
+
+def drive(sim, ticks, step_ticks=1):
+    """Run the scripted runner for ticks; return how often it finished the level"""
+    completed = 0
+    for _ in range(ticks // step_ticks):
+        sim.step(scripted_inputs(sim), step_ticks)
+        # Stay on the level being measured
+        if sim.level_completed:
+            completed += 1
+            sim.level_completed = False
+            sim.load_level()
+        elif sim.game_over:
+            sim.reset()
+    return completed
+
+def make_physics(name):
+    if name == 'numpy':
+        import smb_batch
+        return smb_batch.EnemyPhysics()
+    return None
+
+def bench_level(game, world, level, width_scale, enemy_scale, ticks, frames, repeats,
+                enemy_physics=None, streaming=False, step_ticks=1):
+    def new_sim():
+        return smb14k.Simulation(world, level, width_scale, enemy_scale,
+                                 make_physics(enemy_physics), streaming)
+
+    gen_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        if streaming:
+            smb14k.generate_chunk(world, level, 0, width_scale, enemy_scale)
+        else:
+            smb14k.generate_level(world, level, width_scale, enemy_scale)
+        gen_times.append(time.perf_counter() - start)
+    if streaming:
+        sim = new_sim()
+        load = sim.load_level
+    else:
+        load = smb14k.CompiledLevel.compile(world, level, width_scale, enemy_scale).instantiate
+    load_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        load()
+        load_times.append(time.perf_counter() - start)
+
+    sim = new_sim()
+    start = time.perf_counter()
+    completed = drive(sim, ticks, step_ticks)
+    tick_time = time.perf_counter() - start
+
+    # Render the same scripted run, stepping between frames untimed
+    sim = new_sim()
+    game.sim = sim
+    render_time = 0.0
+    for _ in range(frames):
+        drive(sim, 1)
+        start = time.perf_counter()
+        game.draw_world()
+        game.draw_hud()
+        pygame.display.flip()
+        render_time += time.perf_counter() - start
+
+    tracemalloc.start()
+    sim = new_sim()
+    drive(sim, min(ticks, 120))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'gen_ms': round(min(gen_times) * 1000, 3),
+        'load_ms': round(min(load_times) * 1000, 3),
+        'ticks_per_sec': round(ticks / tick_time, 1),
+        'frames_per_sec': round(frames / render_time, 1),
+        'peak_kb': round(peak / 1024, 1),
+        'completed': completed,
+    }
+
+def parse_levels(spec):
+    if spec == 'all':
+        return [(w, l) for w in range(1, 9) for l in range(1, 5)]
+    levels = []
+    for item in spec.split(','):
+        world, level = item.split('-')
+        levels.append((int(world), int(level)))
+    return levels
+
+def compare(results, baseline, tolerance):
+    """Return human-readable regressions against a baseline result file"""
+    regressions = []
+    for key, metrics in results['levels'].items():
+        old = baseline.get('levels', {}).get(key)
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in old or not old[metric]:
+                continue
+            change = (metrics[metric] - old[metric]) / old[metric]
+            if higher_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append(f"{key} {metric}: {old[metric]} -> {metrics[metric]} "
+                                   f"({change:+.0%} worse)")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--levels', default='all',
+                        help="'all' or a comma-separated list such as 1-1,8-4")
+    parser.add_argument('--variants', default=','.join(VARIANTS),
+                        help='comma-separated subset of: ' + ', '.join(VARIANTS))
+    parser.add_argument('--ticks', type=int, default=600, help='simulation ticks per level')
+    parser.add_argument('--frames', type=int, default=120, help='rendered frames per level')
+    parser.add_argument('--repeats', type=int, default=3, help='generate_level runs per level')
+    parser.add_argument('--output', metavar='PATH', help='write JSON results to PATH instead of stdout')
+    parser.add_argument('--baseline', metavar='PATH', help='compare against an earlier JSON result')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed relative slowdown before a metric counts as a regression')
+    parser.add_argument('--enemy-physics', choices=('scalar', 'numpy'), default='scalar',
+                        help='enemy physics backend to simulate with')
+    parser.add_argument('--streaming', action='store_true',
+                        help='generate levels chunk by chunk as the camera advances')
+    parser.add_argument('--step-ticks', type=int, default=1,
+                        help='ticks per Simulation.step call when measuring ticks_per_sec')
+    args = parser.parse_args(argv)
+
+    game = smb14k.Game()
+    results = {
+        'python': sys.version.split()[0],
+        'pygame': pygame.version.ver,
+        'settings': {'ticks': args.ticks, 'frames': args.frames, 'repeats': args.repeats,
+                     'enemy_physics': args.enemy_physics, 'streaming': args.streaming,
+                     'step_ticks': args.step_ticks},
+        'levels': {},
+    }
+    for variant in args.variants.split(','):
+        width_scale, enemy_scale = VARIANTS[variant]
+        for world, level in parse_levels(args.levels):
+            key = f"{variant}/{world}-{level}"
+            results['levels'][key] = bench_level(game, world, level, width_scale, enemy_scale,
+                                                 args.ticks, args.frames, args.repeats,
+                                                 args.enemy_physics, args.streaming,
+                                                 args.step_ticks)
+            print(key, results['levels'][key], file=sys.stderr)
+    pygame.quit()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
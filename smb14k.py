@@ -1,6 +1,20 @@
 import pygame
 from pygame.locals import *
+import argparse
+import csv
+import marshal
 import math
+import mmap
+import os
+import queue
+import random
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
 
 pygame.init()
 
@@ -21,6 +35,7 @@ UNDERGROUND = (0, 0, 0)
 COIN_YELLOW = (252, 188, 60)
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
+HOLE = (255, 0, 255)  # Colorkey for broken tiles in a merged brick run
 
 class Camera:
     def __init__(self, width, height):
@@ -31,19 +46,82 @@ class Camera:
     def apply(self, entity):
         return entity.rect.move(-self.rect.x, -self.rect.y)
 
+    @property
+    def view(self):
+        """The visible part of the level"""
+        return pygame.Rect(self.rect.x, self.rect.y, SCREEN_WIDTH, SCREEN_HEIGHT)
+
     def update(self, target):
         x = target.rect.centerx - SCREEN_WIDTH // 2
         x = max(0, min(x, self.width - SCREEN_WIDTH))
         self.rect.x = x
 
+# Shared sprite images keyed by (kind, width, height, state)
+image_cache = {}
+
+def display_format(surface, alpha=False):
+    """Convert a surface to the display pixel format once a display exists"""
+    if pygame.display.get_surface() is None:
+        return surface
+    return surface.convert_alpha() if alpha else surface.convert()
+
+def draw_image(kind, width, height, state=None):
+    if kind == 'flag':
+        image = pygame.Surface((width, height), pygame.SRCALPHA)
+        # Draw flagpole
+        pygame.draw.rect(image, (100, 100, 100), (0, 0, 10, height))
+        # Draw flag (triangular)
+        pygame.draw.polygon(image, (0, 255, 0), [(10, 20), (45, 35), (10, 50)])
+        return display_format(image, alpha=True)
+
+    image = pygame.Surface((width, height))
+    if kind == 'player':
+        image.fill((255, 0, 0))  # Mario red
+        pygame.draw.rect(image, (0, 0, 255), (0, 16, width, 16))  # Blue overalls
+    elif kind == 'coin':
+        pygame.draw.circle(image, COIN_YELLOW, (width // 2, height // 2), width // 2)
+    # Enemies
+    elif kind == 'goomba':
+        image.fill((139, 69, 19))
+    elif kind == 'koopa':
+        image.fill((0, 200, 0))
+    elif kind == 'piranha':
+        image.fill((0, 255, 0))
+    elif kind == 'bowser':
+        image.fill((255, 0, 0))
+    # Platforms
+    elif kind == 'ground':
+        image.fill(GROUND)
+    elif kind == 'brick':
+        image.fill(BRICK)
+    elif kind == 'pipe':
+        image.fill(PIPE)
+    elif kind == 'castle':
+        image.fill(CASTLE_GRAY)
+    elif kind == 'lava':
+        image.fill(LAVA_RED)
+    elif kind == 'question':
+        if state == 'used':
+            image.fill(CASTLE_GRAY)
+        else:
+            image.fill((255, 200, 0))
+            pygame.draw.rect(image, BLACK, (width//3, height//3, width//3, height//3))
+    return display_format(image)
+
+def get_image(kind, width, height, state=None):
+    """Return the shared image for a sprite kind; callers must not draw on it"""
+    key = (kind, width, height, state)
+    image = image_cache.get(key)
+    if image is None:
+        image = image_cache[key] = draw_image(kind, width, height, state)
+    return image
+
 class Player(pygame.sprite.Sprite):
     def __init__(self, x, y):
         super().__init__()
         self.width = 24
         self.height = 32
-        self.image = pygame.Surface((self.width, self.height))
-        self.image.fill((255, 0, 0))  # Mario red
-        pygame.draw.rect(self.image, (0, 0, 255), (0, 16, self.width, 16))  # Blue overalls
+        self.image = get_image('player', self.width, self.height)
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
@@ -104,22 +182,12 @@ class Enemy(pygame.sprite.Sprite):
         self.width = 24
         self.height = 24
         
-        if enemy_type == 'goomba':
-            self.image = pygame.Surface((self.width, self.height))
-            self.image.fill((139, 69, 19))
-        elif enemy_type == 'koopa':
-            self.image = pygame.Surface((self.width, 32))
-            self.image.fill((0, 200, 0))
-            self.height = 32
-        elif enemy_type == 'piranha':
-            self.image = pygame.Surface((self.width, 32))
-            self.image.fill((0, 255, 0))
+        if enemy_type == 'koopa' or enemy_type == 'piranha':
             self.height = 32
         elif enemy_type == 'bowser':
             self.width = 48
             self.height = 48
-            self.image = pygame.Surface((self.width, self.height))
-            self.image.fill((255, 0, 0))
+        self.image = get_image(enemy_type, self.width, self.height)
         
         self.rect = self.image.get_rect()
         self.rect.x = x
@@ -137,36 +205,51 @@ class Enemy(pygame.sprite.Sprite):
             self.rect.y += self.vel_y
 
 class Platform(pygame.sprite.Sprite):
-    def __init__(self, x, y, width, height, platform_type='ground'):
+    def __init__(self, x, y, width, height, platform_type='ground', tile_width=0):
         super().__init__()
         self.platform_type = platform_type
-        self.image = pygame.Surface((width, height))
-        
-        if platform_type == 'ground':
-            self.image.fill(GROUND)
-        elif platform_type == 'brick':
-            self.image.fill(BRICK)
-        elif platform_type == 'pipe':
-            self.image.fill(PIPE)
-        elif platform_type == 'castle':
-            self.image.fill(CASTLE_GRAY)
-        elif platform_type == 'lava':
-            self.image.fill(LAVA_RED)
-        elif platform_type == 'question':
-            self.image.fill((255, 200, 0))
-            pygame.draw.rect(self.image, BLACK, (width//3, height//3, width//3, height//3))
+        self.image = get_image(platform_type, width, height)
         
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
         self.breakable = platform_type == 'brick'
         self.has_item = platform_type == 'question'
+        
+        # A merged run of breakable tiles remembers which tiles are intact
+        self.tile_width = tile_width
+        self.tiles = bytearray(b'\x01') * (width // tile_width) if tile_width else None
+
+    def intact_tiles(self, rect):
+        """Indices of the intact tiles of a merged run that overlap rect"""
+        first = max(0, (rect.left - self.rect.left) // self.tile_width)
+        last = min(len(self.tiles) - 1, (rect.right - 1 - self.rect.left) // self.tile_width)
+        return [i for i in range(first, last + 1) if self.tiles[i]]
+
+    def break_tile(self, index):
+        self.tiles[index] = 0
+        if not any(self.tiles):
+            self.kill()
+            return
+        self.draw_tiles()
+
+    def draw_tiles(self):
+        """Redraw a merged run with holes where its tiles are broken"""
+        # A new image rather than an edit in place, so the cached image stays
+        # intact and renderers see the change
+        image = get_image(self.platform_type, self.rect.width, self.rect.height)
+        if not all(self.tiles):
+            image = image.copy()
+            image.set_colorkey(HOLE)
+            for index, intact in enumerate(self.tiles):
+                if not intact:
+                    image.fill(HOLE, (index * self.tile_width, 0, self.tile_width, self.rect.height))
+        self.image = image
 
 class Coin(pygame.sprite.Sprite):
     def __init__(self, x, y):
         super().__init__()
-        self.image = pygame.Surface((20, 20))
-        pygame.draw.circle(self.image, COIN_YELLOW, (10, 10), 10)
+        self.image = get_image('coin', 20, 20)
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
@@ -174,246 +257,1242 @@ class Coin(pygame.sprite.Sprite):
 class Flag(pygame.sprite.Sprite):
     def __init__(self, x, y):
         super().__init__()
-        self.image = pygame.Surface((50, 200), pygame.SRCALPHA)
-        # Draw flagpole
-        pygame.draw.rect(self.image, (100, 100, 100), (0, 0, 10, 200))
-        # Draw flag (triangular)
-        pygame.draw.polygon(self.image, (0, 255, 0), [(10, 20), (45, 35), (10, 50)])
+        self.image = get_image('flag', 50, 200)
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
 
-# Level definitions - 32 levels inspired by SMB1
-def generate_level(world, level):
-    """Generate level layout based on world and level number"""
-    platforms = pygame.sprite.Group()
-    enemies = pygame.sprite.Group()
-    coins = pygame.sprite.Group()
-    items = pygame.sprite.Group()
-    
-    level_width = 30 * TILE_SIZE  # Base level width
-    
-    # Always create a flag at the end of the level
-    flag = Flag(level_width - 2 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 8)
-    
-    # Ground for all levels
-    for x in range(0, level_width, TILE_SIZE):
-        if x < level_width - 5 * TILE_SIZE:  # Leave gap before flag
-            ground = Platform(x, SCREEN_HEIGHT - TILE_SIZE * 2, TILE_SIZE, TILE_SIZE * 2, 'ground')
-            platforms.add(ground)
-    
-    # Add flag platform
-    flag_platform = Platform(level_width - 3 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 2, 
-                            TILE_SIZE * 3, TILE_SIZE * 2, 'ground')
-    platforms.add(flag_platform)
-    
-    # World-specific theming
+class SpatialGroup(pygame.sprite.Group):
+    """Sprite group with a uniform tile-grid index for static sprites.
+
+    Sprites are bucketed by the grid cells their rect overlaps when they are
+    added, so collision queries only look at nearby cells. Because the index
+    is maintained in add_internal/remove_internal, kill() keeps it in sync.
+    """
+
+    def __init__(self, *sprites, cell_size=TILE_SIZE * 2):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.order = {}
+        self.next_order = 0
+        super().__init__(*sprites)
+
+    def cells_for(self, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.order[sprite] = self.next_order
+        self.next_order += 1
+        for cell in self.cells_for(sprite.rect):
+            self.cells.setdefault(cell, []).append(sprite)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        del self.order[sprite]
+        for cell in self.cells_for(sprite.rect):
+            bucket = self.cells.get(cell)
+            if bucket is not None:
+                bucket.remove(sprite)
+                if not bucket:
+                    del self.cells[cell]
+
+    def query(self, rect):
+        """Return indexed sprites whose rect overlaps rect, in insertion order"""
+        found = set()
+        for cell in self.cells_for(rect):
+            bucket = self.cells.get(cell)
+            if bucket:
+                found.update(bucket)
+        hits = [sprite for sprite in found if rect.colliderect(sprite.rect)]
+        hits.sort(key=self.order.__getitem__)
+        return hits
+
+    def collide(self, sprite):
+        """Drop-in replacement for pygame.sprite.spritecollide(sprite, self, False)"""
+        return self.query(sprite.rect)
+
+# Levels are built from segments of SEGMENT_WIDTH, each themed by its world
+SEGMENT_WIDTH = 30 * TILE_SIZE
+
+def generate_segment(world, level, ox, level_width, platforms, coins, add_enemy):
+    """Add the world's platforms, coins and enemies for the segment starting at ox"""
+    segment_width = SEGMENT_WIDTH
     if world == 1:  # Overworld
         # Add pipes
         for i in range(3, 20, 7):
-            pipe = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 
+            pipe = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 
                           TILE_SIZE * 2, TILE_SIZE * 2, 'pipe')
             platforms.add(pipe)
-            
+        
             # Add piranha plants in some pipes
             if i % 2 == 0:
-                enemy = Enemy(i * TILE_SIZE + TILE_SIZE//2, SCREEN_HEIGHT - TILE_SIZE * 5, 'piranha')
-                enemies.add(enemy)
-        
+                add_enemy(ox + i * TILE_SIZE + TILE_SIZE//2, SCREEN_HEIGHT - TILE_SIZE * 5, 'piranha')
+    
         # Add question blocks and bricks
         for i in range(5, 25, 4):
             height = SCREEN_HEIGHT - TILE_SIZE * (5 + (i % 3))
             if i % 2 == 0:
-                block = Platform(i * TILE_SIZE, height, TILE_SIZE, TILE_SIZE, 'question')
+                block = Platform(ox + i * TILE_SIZE, height, TILE_SIZE, TILE_SIZE, 'question')
             else:
-                block = Platform(i * TILE_SIZE, height, TILE_SIZE, TILE_SIZE, 'brick')
+                block = Platform(ox + i * TILE_SIZE, height, TILE_SIZE, TILE_SIZE, 'brick')
             platforms.add(block)
-            
+        
             # Add coins above some blocks
             if i % 3 == 0:
-                coin = Coin(i * TILE_SIZE + 6, height - TILE_SIZE)
+                coin = Coin(ox + i * TILE_SIZE + 6, height - TILE_SIZE)
                 coins.add(coin)
-        
+    
         # Add goombas
         for i in range(4, 20, 5):
-            enemy = Enemy(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'goomba')
-            enemies.add(enemy)
-    
+            add_enemy(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'goomba')
+
     elif world == 2:  # Underground
         # Create underground ceiling
-        for x in range(0, level_width, TILE_SIZE):
+        for x in range(ox, ox + segment_width, TILE_SIZE):
             ceiling = Platform(x, 0, TILE_SIZE, TILE_SIZE * 2, 'brick')
             platforms.add(ceiling)
-        
+    
         # Add platforms
         for i in range(3, 20, 3):
-            platform = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * (4 + i % 3), 
+            platform = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * (4 + i % 3), 
                               TILE_SIZE * 3, TILE_SIZE, 'brick')
             platforms.add(platform)
-            
+        
             # Add coins on platforms
             for j in range(3):
-                coin = Coin(i * TILE_SIZE + j * TILE_SIZE + 6, 
+                coin = Coin(ox + i * TILE_SIZE + j * TILE_SIZE + 6, 
                           SCREEN_HEIGHT - TILE_SIZE * (5 + i % 3))
                 coins.add(coin)
-        
+    
         # Add koopa troopas
         for i in range(5, 20, 6):
-            enemy = Enemy(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'koopa')
-            enemies.add(enemy)
-    
+            add_enemy(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'koopa')
+
     elif world == 3:  # Athletic/Sky
         # Create floating platforms
         for i in range(2, 25, 2):
             y_offset = math.sin(i * 0.5) * 3
-            platform = Platform(i * TILE_SIZE, 
+            platform = Platform(ox + i * TILE_SIZE, 
                               SCREEN_HEIGHT - TILE_SIZE * (3 + int(y_offset)), 
                               TILE_SIZE * 2, TILE_SIZE, 'brick')
             platforms.add(platform)
-            
+        
             # Add coins between platforms
             if i % 4 == 0:
                 for j in range(3):
-                    coin = Coin(i * TILE_SIZE + j * 20, 
+                    coin = Coin(ox + i * TILE_SIZE + j * 20, 
                               SCREEN_HEIGHT - TILE_SIZE * (5 + int(y_offset)))
                     coins.add(coin)
-        
+    
         # Flying koopas
         for i in range(4, 20, 8):
-            enemy = Enemy(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 6, 'koopa')
-            enemies.add(enemy)
-    
+            add_enemy(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 6, 'koopa')
+
     elif world == 4:  # Castle
         # Lava pits
         for i in range(5, 25, 5):
-            lava = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE, 
+            lava = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE, 
                           TILE_SIZE * 2, TILE_SIZE, 'lava')
             platforms.add(lava)
-        
+    
         # Castle blocks
         for i in range(3, 25, 3):
-            block = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 
+            block = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 
                            TILE_SIZE * 2, TILE_SIZE, 'castle')
             platforms.add(block)
-        
+    
         # Add Bowser at the end of castle levels
         if level == 4:
-            boss = Enemy(level_width - 5 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 'bowser')
-            enemies.add(boss)
+            if ox + segment_width == level_width:
+                add_enemy(level_width - 5 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 'bowser')
         else:
             # Regular enemies for non-boss castle levels
             for i in range(4, 20, 4):
-                enemy = Enemy(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'goomba')
-                enemies.add(enemy)
-    
+                add_enemy(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'goomba')
+
     elif world == 5:  # Water world (simplified as platforms over water)
         # Water platforms
         for i in range(2, 25, 3):
-            platform = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 
+            platform = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 
                               TILE_SIZE * 3, TILE_SIZE, 'brick')
             platforms.add(platform)
-            
+        
             # Coins above water
-            coin = Coin(i * TILE_SIZE + TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4)
+            coin = Coin(ox + i * TILE_SIZE + TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4)
             coins.add(coin)
-        
+    
         # Swimming enemies (represented as jumping koopas)
         for i in range(6, 20, 5):
-            enemy = Enemy(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 'koopa')
-            enemies.add(enemy)
-    
+            add_enemy(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 'koopa')
+
     elif world == 6:  # Ice world
         # Slippery platforms
         for i in range(3, 25, 4):
-            platform = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 
+            platform = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 
                               TILE_SIZE * 4, TILE_SIZE, 'brick')
             platforms.add(platform)
-        
+    
         # Add enemies
         for i in range(5, 20, 6):
-            enemy = Enemy(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'koopa')
-            enemies.add(enemy)
-    
+            add_enemy(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'koopa')
+
     elif world == 7:  # Pipe world
         # Many pipes of varying heights
         for i in range(2, 25, 2):
             height = 2 + (i % 4)
-            pipe = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * (height + 2), 
+            pipe = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * (height + 2), 
                           TILE_SIZE * 2, TILE_SIZE * height, 'pipe')
             platforms.add(pipe)
-            
+        
             # Piranha plants in pipes
             if i % 3 == 0:
-                enemy = Enemy(i * TILE_SIZE + TILE_SIZE//2, 
+                add_enemy(ox + i * TILE_SIZE + TILE_SIZE//2, 
                             SCREEN_HEIGHT - TILE_SIZE * (height + 3), 'piranha')
-                enemies.add(enemy)
-    
+
     elif world == 8:  # Final world - combination of all challenges
         # Mixed platform types
         for i in range(2, 25):
             if i % 5 == 0:
                 # Lava pit
-                lava = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE, 
+                lava = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE, 
                               TILE_SIZE, TILE_SIZE, 'lava')
                 platforms.add(lava)
             elif i % 3 == 0:
                 # Floating platform
-                platform = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 5, 
+                platform = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 5, 
                                   TILE_SIZE * 2, TILE_SIZE, 'castle')
                 platforms.add(platform)
             elif i % 2 == 0:
                 # Question block
-                block = Platform(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 
+                block = Platform(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 
                                TILE_SIZE, TILE_SIZE, 'question')
                 platforms.add(block)
-        
+    
         # Multiple enemy types
         for i in range(3, 20, 3):
             if i % 6 == 0:
-                enemy = Enemy(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'koopa')
+                add_enemy(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'koopa')
             else:
-                enemy = Enemy(i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'goomba')
-            enemies.add(enemy)
-        
+                add_enemy(ox + i * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 3, 'goomba')
+    
         # Final Bowser
-        if level == 4:
-            boss = Enemy(level_width - 5 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 'bowser')
-            enemies.add(boss)
+        if level == 4 and ox + segment_width == level_width:
+            add_enemy(level_width - 5 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 4, 'bowser')
+
+# Level definitions - 32 levels inspired by SMB1
+def generate_level(world, level, width_scale=1, enemy_scale=1):
+    """Generate level layout based on world and level number
+
+    width_scale repeats the level's features that many times across a wider
+    level and enemy_scale spawns extra copies of every enemy; both exist for
+    stress-testing and default to the normal level.
+    """
+    platforms = SpatialGroup()
+    enemies = pygame.sprite.Group()
+    coins = SpatialGroup()
+    items = pygame.sprite.Group()
+    
+    segment_width = SEGMENT_WIDTH  # Base level width
+    level_width = segment_width * width_scale
+    
+    def add_enemy(x, y, enemy_type):
+        # Extra copies are spread a few pixels apart
+        for k in range(enemy_scale):
+            enemies.add(Enemy(x + k * 4, y, enemy_type))
+    
+    # Always create a flag at the end of the level
+    flag = Flag(level_width - 2 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 8)
+    
+    # Ground for all levels
+    for x in range(0, level_width, TILE_SIZE):
+        if x < level_width - 5 * TILE_SIZE:  # Leave gap before flag
+            ground = Platform(x, SCREEN_HEIGHT - TILE_SIZE * 2, TILE_SIZE, TILE_SIZE * 2, 'ground')
+            platforms.add(ground)
+    
+    # Add flag platform
+    flag_platform = Platform(level_width - 3 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 2, 
+                            TILE_SIZE * 3, TILE_SIZE * 2, 'ground')
+    platforms.add(flag_platform)
+    
+    # World-specific theming, repeated once per segment
+    for ox in range(0, level_width, segment_width):
+        generate_segment(world, level, ox, level_width, platforms, coins, add_enemy)
     
     return platforms, enemies, coins, items, flag, level_width
 
-class Game:
+# Type codes used by compiled levels
+PLATFORM_TYPES = ('ground', 'brick', 'pipe', 'castle', 'lava', 'question')
+ENEMY_TYPES = ('goomba', 'koopa', 'piranha', 'bowser')
+
+# Platform types whose adjacent tiles are merged when a level is compiled,
+# into platforms at most MAX_MERGED_WIDTH wide so images stay small
+MERGED_PLATFORM_TYPES = ('ground', 'brick', 'pipe', 'castle', 'lava')
+MAX_MERGED_WIDTH = 32 * TILE_SIZE
+
+def merge_platform_runs(platforms):
+    """Merge runs of same-type tiles into single wide platforms.
+
+    Only platforms that are consecutive in generation order, share a type,
+    row and height and touch horizontally are merged, so collision order is
+    unchanged. Returns [type, x, y, width, height, tile_width] records;
+    tile_width is set for merged brick runs so tiles can still break one
+    at a time, and 0 otherwise.
+    """
+    merged = []
+    for p in platforms:
+        rect = p.rect
+        if merged:
+            last = merged[-1]
+            if (p.platform_type in MERGED_PLATFORM_TYPES and last[0] == p.platform_type
+                    and last[2] == rect.y and last[4] == rect.height
+                    and last[1] + last[3] == rect.x and last[3] + rect.width <= MAX_MERGED_WIDTH
+                    and (p.platform_type != 'brick' or last[5] == rect.width)):
+                last[3] += rect.width
+                continue
+        merged.append([p.platform_type, rect.x, rect.y, rect.width, rect.height,
+                       rect.width if p.platform_type == 'brick' else 0])
+    for record in merged:
+        if record[3] == record[5]:
+            record[5] = 0  # A single brick breaks as a whole
+    return merged
+
+class CompiledLevel:
+    """A generated level reduced to flat int32 arrays.
+
+    platforms holds (type, x, y, width, height, tile width) per platform in
+    generation order, with runs of adjacent tiles merged by
+    merge_platform_runs; enemies holds (type, x, y) and coins (x, y).
+    instantiate() builds the level's sprites without rerunning the
+    generator.
+    """
+    HEADER = struct.Struct('<6i')
+
+    def __init__(self, level_width, flag_pos, platforms, enemies, coins):
+        self.level_width = level_width
+        self.flag_pos = flag_pos
+        self.platforms = platforms
+        self.enemies = enemies
+        self.coins = coins
+
+    @classmethod
+    def compile(cls, world, level, width_scale=1, enemy_scale=1):
+        platforms, enemies, coins, items, flag, level_width = generate_level(
+            world, level, width_scale, enemy_scale)
+        platform_data = array('i')
+        for record in merge_platform_runs(platforms):
+            platform_data.append(PLATFORM_TYPES.index(record[0]))
+            platform_data.extend(record[1:])
+        enemy_data = array('i')
+        for e in enemies:
+            enemy_data.extend((ENEMY_TYPES.index(e.enemy_type), e.rect.x, e.rect.y))
+        coin_data = array('i')
+        for c in coins:
+            coin_data.extend(c.rect.topleft)
+        return cls(level_width, flag.rect.topleft, platform_data, enemy_data, coin_data)
+
+    def to_bytes(self):
+        header = self.HEADER.pack(self.level_width, *self.flag_pos, len(self.platforms),
+                                  len(self.enemies), len(self.coins))
+        return header + self.platforms.tobytes() + self.enemies.tobytes() + self.coins.tobytes()
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """Rebuild from to_bytes() output; the arrays are views into buffer"""
+        level_width, flag_x, flag_y, n_platforms, n_enemies, n_coins = cls.HEADER.unpack_from(buffer)
+        data = memoryview(buffer)[cls.HEADER.size:].cast('i')
+        platforms = data[:n_platforms]
+        enemies = data[n_platforms:n_platforms + n_enemies]
+        coins = data[n_platforms + n_enemies:n_platforms + n_enemies + n_coins]
+        return cls(level_width, (flag_x, flag_y), platforms, enemies, coins)
+
+    def instantiate(self):
+        """Return fresh sprites in the same form as generate_level"""
+        platforms = SpatialGroup()
+        data = self.platforms
+        for i in range(0, len(data), 6):
+            platforms.add(Platform(data[i + 1], data[i + 2], data[i + 3], data[i + 4],
+                                   PLATFORM_TYPES[data[i]], data[i + 5]))
+        enemies = pygame.sprite.Group()
+        data = self.enemies
+        for i in range(0, len(data), 3):
+            enemies.add(Enemy(data[i + 1], data[i + 2], ENEMY_TYPES[data[i]]))
+        coins = SpatialGroup()
+        data = self.coins
+        for i in range(0, len(data), 2):
+            coins.add(Coin(data[i], data[i + 1]))
+        return (platforms, enemies, coins, pygame.sprite.Group(),
+                Flag(*self.flag_pos), self.level_width)
+
+class LevelCache:
+    """LRU cache of compiled levels, optionally backed by a memory-mapped file.
+
+    Levels are keyed by (world, level, width_scale, enemy_scale). With a
+    cache file, levels compiled by earlier runs are read straight from the
+    mapped file; the file is stamped with a fingerprint of generate_level
+    and the constants it uses, and ignored when either changes.
+    """
+    FILE_MAGIC = b'SMBL'
+    FILE_HEADER = struct.Struct('<4sII')  # magic, generator fingerprint, entry count
+    FILE_ENTRY = struct.Struct('<BBHHQI')  # world, level, width/enemy scale, offset, size
+
+    def __init__(self, capacity=8, path=None):
+        self.capacity = capacity
+        self.levels = OrderedDict()
+        self.path = None
+        self.mapped = None
+        self.stored = {}  # key -> (offset, size) in the mapped file
+        self.fingerprint = zlib.crc32(marshal.dumps(
+            (generate_level.__code__, generate_segment.__code__, merge_platform_runs.__code__,
+             CompiledLevel.compile.__func__.__code__, TILE_SIZE, SCREEN_HEIGHT, SEGMENT_WIDTH,
+             MAX_MERGED_WIDTH, PLATFORM_TYPES, ENEMY_TYPES)))
+        if path:
+            self.open(path)
+
+    def open(self, path):
+        """Use path as the persistent cache file, mapping it if it exists"""
+        self.close()
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+        try:
+            magic, fingerprint, count = self.FILE_HEADER.unpack_from(self.mapped)
+        except struct.error:
+            magic = None
+        if magic != self.FILE_MAGIC or fingerprint != self.fingerprint:
+            self.close()
+            self.path = path
+            return
+        pos = self.FILE_HEADER.size
+        for _ in range(count):
+            world, level, width_scale, enemy_scale, offset, size = \
+                self.FILE_ENTRY.unpack_from(self.mapped, pos)
+            self.stored[(world, level, width_scale, enemy_scale)] = (offset, size)
+            pos += self.FILE_ENTRY.size
+
+    def close(self):
+        self.levels.clear()
+        self.stored = {}
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.path = None
+
+    def get(self, world, level, width_scale=1, enemy_scale=1):
+        key = (world, level, width_scale, enemy_scale)
+        compiled = self.levels.get(key)
+        if compiled is not None:
+            self.levels.move_to_end(key)
+            return compiled
+        if key in self.stored:
+            offset, size = self.stored[key]
+            # A copy, not a view: save() unmaps the file while levels are still in use
+            compiled = CompiledLevel.from_buffer(self.mapped[offset:offset + size])
+        else:
+            compiled = CompiledLevel.compile(*key)
+            if self.path:
+                self.save(key, compiled)
+        self.levels[key] = compiled
+        if len(self.levels) > self.capacity:
+            self.levels.popitem(last=False)
+        return compiled
+
+    def save(self, key, compiled):
+        """Rewrite the cache file with every stored level plus this one.
+
+        Processes may share the file, so it is reread first to keep levels
+        others stored, then written under a unique name and renamed into
+        place. A failed write only leaves the level uncached.
+        """
+        path = self.path
+        levels = self.levels.copy()
+        self.open(path)
+        blobs = {k: self.mapped[offset:offset + size] for k, (offset, size) in self.stored.items()}
+        blobs[key] = compiled.to_bytes()
+        offset = self.FILE_HEADER.size + self.FILE_ENTRY.size * len(blobs)
+        out = bytearray(self.FILE_HEADER.pack(self.FILE_MAGIC, self.fingerprint, len(blobs)))
+        stored = {}
+        for k, blob in blobs.items():
+            out += self.FILE_ENTRY.pack(*k, offset, len(blob))
+            stored[k] = (offset, len(blob))
+            offset += len(blob)
+        for blob in blobs.values():
+            out += blob
+
+        self.close()
+        directory = os.path.dirname(path)
+        temp = None
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd, temp = tempfile.mkstemp(suffix='.tmp', dir=directory or None)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(out)
+            os.replace(temp, path)
+        except OSError:
+            if temp is not None and os.path.exists(temp):
+                os.remove(temp)
+        self.open(path)
+        self.levels = levels
+
+# Compiled levels shared by every Simulation in the process
+level_cache = LevelCache(path=os.environ.get('SMB14K_LEVEL_CACHE'))
+
+def generate_chunk(world, level, index, width_scale=1, enemy_scale=1):
+    """Generate the platforms, enemies and coins of one segment of a level.
+
+    Produces the same content as that stretch of generate_level, for levels
+    too long to generate at once.
+    """
+    platforms = pygame.sprite.Group()
+    enemies = []
+    coins = pygame.sprite.Group()
+    ox = index * SEGMENT_WIDTH
+    level_width = SEGMENT_WIDTH * width_scale
+
+    def add_enemy(x, y, enemy_type):
+        for k in range(enemy_scale):
+            enemies.append(Enemy(x + k * 4, y, enemy_type))
+
+    for x in range(ox, ox + SEGMENT_WIDTH, TILE_SIZE):
+        if x < level_width - 5 * TILE_SIZE:
+            platforms.add(Platform(x, SCREEN_HEIGHT - TILE_SIZE * 2, TILE_SIZE, TILE_SIZE * 2, 'ground'))
+    if ox + SEGMENT_WIDTH == level_width:
+        platforms.add(Platform(level_width - 3 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 2,
+                               TILE_SIZE * 3, TILE_SIZE * 2, 'ground'))
+    generate_segment(world, level, ox, level_width, platforms, coins, add_enemy)
+    return platforms, enemies, coins
+
+class LevelStream:
+    """A level generated one segment-wide chunk at a time around the camera.
+
+    Chunks are generated when they come within `ahead` chunks of the view
+    and dropped again once more than `behind` chunks away, so memory and
+    load time stay the same however long the level is. A dropped chunk that
+    comes back into range is generated afresh, coins and all.
+    """
+
+    def __init__(self, world, level, width_scale=1, enemy_scale=1, ahead=1, behind=2):
+        self.world = world
+        self.level = level
+        self.width_scale = width_scale
+        self.enemy_scale = enemy_scale
+        self.ahead = ahead
+        self.behind = behind
+        self.level_width = SEGMENT_WIDTH * width_scale
+        self.flag = Flag(self.level_width - 2 * TILE_SIZE, SCREEN_HEIGHT - TILE_SIZE * 8)
+        self.chunks = {}  # index -> sprites generated for that chunk
+
+    def update(self, sim):
+        view = sim.camera.view
+        first = max(0, view.left // SEGMENT_WIDTH - self.behind)
+        last = min(self.width_scale - 1, (view.right - 1) // SEGMENT_WIDTH + self.ahead)
+        for index in [i for i in self.chunks if i < first or i > last]:
+            self.unload(sim, index)
+        for index in range(first, last + 1):
+            if index not in self.chunks:
+                self.load(sim, index)
+
+    def load(self, sim, index):
+        platforms, enemies, coins = generate_chunk(self.world, self.level, index,
+                                                   self.width_scale, self.enemy_scale)
+        platforms = [Platform(x, y, w, h, platform_type, tile_width)
+                     for platform_type, x, y, w, h, tile_width in merge_platform_runs(platforms)]
+        sim.platforms.add(platforms)
+        sim.all_sprites.add(platforms, coins)
+        sim.coins.add(coins)
+        sim.sleeping_enemies.extend(enemies)
+        sim.sleeping_enemies.sort(key=lambda enemy: enemy.rect.x)
+        self.chunks[index] = (platforms, enemies, coins.sprites())
+        if sim.enemy_physics:
+            sim.enemy_physics.invalidate_platforms()
+
+    def unload(self, sim, index):
+        platforms, enemies, coins = self.chunks.pop(index)
+        for sprite in platforms + enemies + coins:
+            sprite.kill()
+        dropped = set(enemies)
+        sim.sleeping_enemies[:] = [e for e in sim.sleeping_enemies if e not in dropped]
+        if sim.enemy_physics:
+            sim.enemy_physics.invalidate_platforms()
+
+class Hud:
+    """Cached HUD text.
+
+    Each field is a fixed label followed by a value such as '000120' or
+    '1-2'. Labels and single value characters are rendered once per font
+    and color and reused: a field is recomposed from those glyphs only when
+    its value changes, and drawing it is a single blit. Any other text, such
+    as the level banners, is cached by content through text().
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self.glyphs = {}  # (font, text, color) -> rendered surface
+        self.fields = []  # (label, value, composed surface, area) per field
+
+    def text(self, font, text, color):
+        key = (font, text, color)
+        surface = self.glyphs.get(key)
+        if surface is None:
+            surface = self.glyphs[key] = font.render(text, True, color)
+        return surface
+
+    def compose(self, label, value, color):
+        glyphs = [self.text(self.font, piece, color) for piece in (label,) + tuple(value)]
+        surface = pygame.Surface((sum(glyph.get_width() for glyph in glyphs),
+                                  max(glyph.get_height() for glyph in glyphs)), pygame.SRCALPHA)
+        x = 0
+        for glyph in glyphs:
+            # Copy glyph pixels and coverage as-is instead of alpha-blending them
+            surface.blit(glyph, (x, 0), special_flags=BLEND_RGBA_MAX)
+            x += glyph.get_width()
+        return display_format(surface, alpha=True)
+
+    def update(self, fields):
+        """Recompose fields whose value changed; returns the areas they touch"""
+        changed = []
+        for i, (label, value, color, pos) in enumerate(fields):
+            old = self.fields[i] if i < len(self.fields) else None
+            if old is None or old[0] != label or old[1] != value:
+                surface = self.compose(label, value, color)
+                area = surface.get_rect(topleft=pos)
+                changed.append(area if old is None else area.union(old[3]))
+                if old is None:
+                    self.fields.append((label, value, surface, area))
+                else:
+                    self.fields[i] = (label, value, surface, area)
+        return changed
+
+    def draw(self, surface, areas=None):
+        """Blit every field, or only those touching one of areas"""
+        for label, value, text, area in self.fields:
+            if areas is None or area.collidelist(areas) != -1:
+                surface.blit(text, area)
+
+# Frame phases timed by FrameProfiler, in the order they run
+PROFILE_PHASES = ('events', 'update', 'collisions', 'world', 'sprites', 'hud', 'flip')
+PHASE_EVENTS, PHASE_UPDATE, PHASE_COLLISIONS, PHASE_WORLD, PHASE_SPRITES, PHASE_HUD, PHASE_FLIP = range(7)
+
+class FrameProfiler:
+    """High-resolution per-phase frame timings kept in a fixed-size ring buffer.
+
+    Code being timed calls lap(phase) when a phase ends; the time since the
+    previous lap is charged to that phase. Holders keep a None profiler when
+    profiling is off, so the only cost left is a truth test per phase.
+    """
+
+    def __init__(self, frames=600):
+        self.frames = frames
+        self.phases = len(PROFILE_PHASES)
+        self.samples = array('q', bytes(8 * frames * self.phases))  # Nanoseconds
+        self.count = 0
+        self.row = 0
+        self.last = time.perf_counter_ns()
+
+    def begin_frame(self):
+        self.row = (self.count % self.frames) * self.phases
+        for i in range(self.row, self.row + self.phases):
+            self.samples[i] = 0
+        self.last = time.perf_counter_ns()
+
+    def lap(self, phase):
+        now = time.perf_counter_ns()
+        self.samples[self.row + phase] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        self.count += 1
+
+    def rows(self):
+        """Yield recorded frames oldest first as (frame number, per-phase ns)"""
+        first = max(0, self.count - self.frames)
+        for frame in range(first, self.count):
+            row = (frame % self.frames) * self.phases
+            yield frame, self.samples[row:row + self.phases]
+
+    def percentiles(self, *quantiles):
+        """Return {phase name: [milliseconds per quantile]} over the buffer"""
+        columns = [[] for _ in PROFILE_PHASES]
+        for _, row in self.rows():
+            for column, value in zip(columns, row):
+                column.append(value)
+        stats = {}
+        for name, column in zip(PROFILE_PHASES, columns):
+            column.sort()
+            if column:
+                stats[name] = [column[min(len(column) - 1, int(q * len(column)))] / 1e6
+                               for q in quantiles]
+            else:
+                stats[name] = [0.0 for q in quantiles]
+        return stats
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame'] + [f'{name}_ms' for name in PROFILE_PHASES] + ['total_ms'])
+            for frame, row in self.rows():
+                writer.writerow([frame] + [f'{value / 1e6:.4f}' for value in row]
+                                + [f'{sum(row) / 1e6:.4f}'])
+
+# Platform types that never change once a level is generated
+STATIC_PLATFORM_TYPES = ('ground', 'pipe', 'castle', 'lava')
+
+def background_color(world):
+    if world == 2:  # Underground
+        return BLACK
+    elif world == 3:  # Sky
+        return (135, 206, 235)  # Sky blue
+    elif world == 4 or world == 8:  # Castle
+        return (50, 50, 50)  # Dark gray
+    return SKY
+
+class StaticLayer:
+    """Static platforms of one level pre-rendered onto background strips, scaled to size.
+
+    Strips are rendered when they first come into view; the max_strips
+    nearest the view are kept.
+    """
+
+    def __init__(self, platforms, world, height=SCREEN_HEIGHT, strip_width=256,
+                 size=(SCREEN_WIDTH, SCREEN_HEIGHT), level=None, max_strips=32):
+        self.platforms = platforms
+        self.level = level  # CompiledLevel or LevelStream the strips were rendered from
+        self.color = background_color(world)
+        self.height = height
+        self.strip_width = strip_width
+        self.size = size
+        self.max_strips = max_strips
+        self.strips = {}
+
+    def render_strip(self, index):
+        area = pygame.Rect(index * self.strip_width, 0, self.strip_width, self.height)
+        strip = display_format(pygame.Surface(area.size))
+        strip.fill(self.color)
+        for platform in self.platforms.query(area):
+            if platform.platform_type in STATIC_PLATFORM_TYPES:
+                strip.blit(platform.image, (platform.rect.x - area.x, platform.rect.y))
+        if self.size != (SCREEN_WIDTH, SCREEN_HEIGHT):
+            width, height = self.size
+            left = area.left * width // SCREEN_WIDTH
+            strip = pygame.transform.scale(strip, (
+                area.right * width // SCREEN_WIDTH - left,
+                area.height * height // SCREEN_HEIGHT))
+        return strip
+
+    def draw(self, surface, view):
+        width = self.strip_width
+        target_width, target_height = self.size
+        x = view.x * target_width // SCREEN_WIDTH
+        y = view.y * target_height // SCREEN_HEIGHT
+        for index in range(view.left // width, (view.right - 1) // width + 1):
+            strip = self.strips.get(index)
+            if strip is None:
+                strip = self.strips[index] = self.render_strip(index)
+            surface.blit(strip, (index * width * target_width // SCREEN_WIDTH - x, -y))
+        if len(self.strips) > self.max_strips:
+            # Forget the strips furthest from the view
+            center = view.centerx // width
+            for index in sorted(self.strips, key=lambda i: abs(i - center))[self.max_strips // 2:]:
+                del self.strips[index]
+
+class Renderer:
+    """Draws a Simulation's world onto a target surface.
+
+    A target that is not screen-sized gets the world drawn directly at its
+    resolution, with each shared sprite image scaled once and cached,
+    instead of drawing at full size and resizing the result.
+    """
+
+    def __init__(self, surface):
+        self.surface = surface
+        self.size = surface.get_size()
+        self.scaled = self.size != (SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.scaled_images = {}
+        self.static_layer = None
+        self.profiler = None
+        # Dirty-rectangle mode: view origin and sprite areas of the last frame
+        self.drawn_view = None
+        self.drawn_platforms = None
+        self.drawn = {}
+
+    def scaled_image(self, image, width, height):
+        key = (image, width, height)
+        scaled = self.scaled_images.get(key)
+        if scaled is None:
+            scaled = self.scaled_images[key] = pygame.transform.scale(image, (width, height))
+        return scaled
+
+    def draw_world(self, sim):
+        # Static platforms only change with the level, so respawns reuse the strips
+        level = sim.stream or sim.compiled_level
+        if self.static_layer is None or self.static_layer.level is not level:
+            self.static_layer = StaticLayer(sim.platforms, sim.current_world, size=self.size,
+                                            level=level)
+        self.static_layer.platforms = sim.platforms
+        view = sim.camera.view
+        self.static_layer.draw(self.surface, view)
+        if self.profiler:
+            self.profiler.lap(PHASE_WORLD)
+
+        # Blit only the sprites inside the camera view
+        blit = self.surface.blit
+        for image, rect in self.place_sprites(self.visible_sprites(sim, view), view).values():
+            blit(image, rect)
+        if self.profiler:
+            self.profiler.lap(PHASE_SPRITES)
+
+    def visible_sprites(self, sim, view):
+        """Sprites inside view other than static platforms, in drawing order"""
+        # Bricks, question blocks and coins never move, so their grid indexes
+        # find them; only the few awake movers need checking one by one
+        sprites = [platform for platform in sim.platforms.query(view)
+                   if platform.platform_type not in STATIC_PLATFORM_TYPES]
+        sprites += sim.coins.query(view)
+        for sprite in (*sim.items, sim.flag, sim.player, *sim.enemies):
+            if sprite.rect.colliderect(view):
+                sprites.append(sprite)
+        return sprites
+
+    def invalidate(self):
+        """Make the next draw_world_dirty repaint everything"""
+        self.drawn_view = None
+
+    def draw_world_dirty(self, sim, forced=()):
+        """Repaint only what changed since the last call.
+
+        Returns the rects of the target surface that were repainted, for
+        pygame.display.update, or None after a full redraw (first frame,
+        new level or a camera scroll). Rects in forced are repainted too.
+        """
+        view = sim.camera.view
+        current = self.place_sprites(self.visible_sprites(sim, view), view)
+
+        if self.drawn_view != view.topleft or self.drawn_platforms is not sim.platforms:
+            self.draw_world(sim)
+            self.drawn_view = view.topleft
+            self.drawn_platforms = sim.platforms
+            self.drawn = current
+            return None
+
+        dirty = list(forced)
+        drawn = self.drawn
+        for sprite, entry in current.items():
+            old = drawn.pop(sprite, None)
+            if old is None:
+                dirty.append(entry[1])
+            elif old != entry:
+                dirty.append(old[1].union(entry[1]))
+        # Sprites that were killed or left the view
+        dirty.extend(rect for image, rect in drawn.values())
+        self.drawn = current
+        if self.profiler:
+            self.profiler.lap(PHASE_WORLD)
+
+        surface = self.surface
+        for area in dirty:
+            surface.set_clip(area)
+            self.static_layer.draw(surface, view)
+            for image, rect in current.values():
+                if rect.colliderect(area):
+                    surface.blit(image, rect)
+        surface.set_clip(None)
+        if self.profiler:
+            self.profiler.lap(PHASE_SPRITES)
+        return dirty
+
+    def place_sprites(self, sprites, view):
+        """Map each sprite to its image and area on the target surface"""
+        if not self.scaled:
+            x, y = view.x, view.y
+            return {sprite: (sprite.image, sprite.rect.move(-x, -y)) for sprite in sprites}
+        # Edges are mapped to target pixels separately so adjacent tiles meet
+        width, height = self.size
+        x = view.x * width // SCREEN_WIDTH
+        y = view.y * height // SCREEN_HEIGHT
+        placed = {}
+        for sprite in sprites:
+            rect = sprite.rect
+            left = rect.left * width // SCREEN_WIDTH
+            top = rect.top * height // SCREEN_HEIGHT
+            w = rect.right * width // SCREEN_WIDTH - left
+            h = rect.bottom * height // SCREEN_HEIGHT - top
+            if w > 0 and h > 0:
+                placed[sprite] = (self.scaled_image(sprite.image, w, h),
+                                  pygame.Rect(left - x, top - y, w, h))
+        return placed
+
+class Interpolator:
+    """Draws the world between the last two simulation ticks.
+
+    capture() records where the player, enemies and camera are before a
+    tick. blend() then moves them alpha of the way from there to their
+    current positions, for drawing only, and restore() puts the simulated
+    positions back.
+    """
+
     def __init__(self):
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption('Super Mario Bros - 32 Levels')
-        self.clock = pygame.time.Clock()
-        self.running = True
-        self.font = pygame.font.Font(None, 36)
-        self.small_font = pygame.font.Font(None, 24)
-        
-        # Game state
-        self.current_world = 1
-        self.current_level = 1
-        self.score = 0
-        self.coins_collected = 0
+        self.platforms = None
+        self.camera_x = 0
+        self.previous = {}
+        self.moved = []
+
+    def capture(self, sim):
+        self.platforms = sim.platforms
+        self.camera_x = sim.camera.rect.x
+        previous = self.previous = {enemy: enemy.rect.topleft for enemy in sim.enemies}
+        previous[sim.player] = sim.player.rect.topleft
+
+    def blend(self, sim, alpha):
+        if sim.platforms is not self.platforms:
+            return  # New level or respawn since the capture
+        moved = self.moved
+        for sprite, (x, y) in self.previous.items():
+            rect = sprite.rect
+            if (x, y) != rect.topleft and sprite.alive():
+                moved.append((rect, rect.topleft))
+                rect.topleft = (round(x + (rect.x - x) * alpha), round(y + (rect.y - y) * alpha))
+        camera = sim.camera.rect
+        moved.append((camera, camera.topleft))
+        camera.x = round(self.camera_x + (camera.x - self.camera_x) * alpha)
+
+    def restore(self):
+        for rect, topleft in self.moved:
+            rect.topleft = topleft
+        self.moved = []
+
+class FramePacer:
+    """Frame pacing for the low-latency mode.
+
+    Rather than sleeping at the top of the frame, wait() returns as late as
+    it can and still have the frame flipped by its deadline: the deadline
+    less the recent cost of a frame, so input is polled just before it is
+    used. A flip that blocks for vsync is left out of that cost and moves
+    the schedule onto the display's refresh. With spin=True the last couple
+    of milliseconds are busy-waited, as sleeping can overshoot by about
+    that much.
+    """
+
+    SPIN_SECONDS = 0.002
+    # Slack left before the deadline; sleeping needs more for its overshoot
+    MARGIN_SECONDS = 0.001
+    SLEEP_MARGIN_SECONDS = 0.003
+
+    def __init__(self, fps, spin=False):
+        self.period = 1 / fps if fps else 0
+        self.spin = spin
+        self.deadline = None
+        self.work = 0.0  # Seconds from wait() returning to the flip, decaying maximum
+        self.started = 0.0
+        self.flipping = 0.0
+
+    def wait(self):
+        now = time.perf_counter()
+        if self.deadline is None:
+            self.deadline = now + self.period
+        margin = self.MARGIN_SECONDS if self.spin else self.SLEEP_MARGIN_SECONDS
+        target = self.deadline - self.work - margin
+        if self.spin:
+            if target - now > self.SPIN_SECONDS:
+                time.sleep(target - now - self.SPIN_SECONDS)
+            while time.perf_counter() < target:
+                pass
+        elif target > now:
+            time.sleep(target - now)
+        self.started = time.perf_counter()
+
+    def flip(self):
+        """Call right before the flip"""
+        self.flipping = time.perf_counter()
+        self.work = max(self.flipping - self.started, self.work * 0.95)
+
+    def flipped(self):
+        """Call right after the flip"""
+        # A late or vsync-blocked flip moves the schedule instead of rushing the next frames
+        self.deadline = max(self.deadline, time.perf_counter()) + self.period
+
+def png_bytes(width, height, rgb):
+    """Encode RGB pixels as a PNG; unlike pygame.image.save, zlib lets other threads run"""
+    stride = width * 3
+    rows = b''.join(b'\0' + rgb[y:y + stride] for y in range(0, stride * height, stride))
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data)))
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows, 1)) + chunk(b'IEND', b''))
+
+class FrameCapture:
+    """Saves displayed frames from a background thread.
+
+    capture() copies every every-th frame, scaled by scale, into one of a
+    fixed pool of buffers and queues it for the writer thread, so the game
+    loop never waits on the disk; when every buffer is queued the frame is
+    dropped. Frames that fail to save are counted in failed.
+    """
+
+    def __init__(self, directory, every=1, scale=1.0, fmt='png', buffers=8):
+        if fmt not in ('png', 'raw'):
+            raise ValueError(f"unknown capture format {fmt!r}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every = every
+        self.fmt = fmt
+        self.scale = scale
+        self.buffers = buffers
+        self.size = None  # Set by the first capture()
+        self.free = queue.SimpleQueue()
+        self.pending = queue.Queue(maxsize=buffers)
+        self.frames = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.raw = open(os.path.join(directory, 'frames.rgb'), 'wb') if fmt == 'raw' else None
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def capture(self, surface):
+        if self.size is None:
+            width, height = surface.get_size()
+            self.size = (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+            for _ in range(self.buffers):
+                self.free.put(pygame.Surface(self.size))
+        frame = self.frames
+        self.frames += 1
+        if frame % self.every:
+            return
+        try:
+            buffer = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return
+        if self.size == surface.get_size():
+            buffer.blit(surface, (0, 0))
+        else:
+            pygame.transform.scale(surface, self.size, buffer)
+        # Never blocks: there are only as many buffers as queue slots
+        self.pending.put_nowait((frame, buffer))
+
+    def write_frames(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            frame, buffer = item
+            rgb = pygame.image.tobytes(buffer, 'RGB')
+            self.free.put(buffer)
+            try:
+                if self.raw:
+                    self.raw.write(rgb)
+                else:
+                    with open(os.path.join(self.directory, f"frame_{frame:06d}.png"), 'wb') as f:
+                        f.write(png_bytes(*self.size, rgb))
+            except OSError:
+                self.failed += 1
+                continue
+            self.written += 1
+
+    def close(self):
+        """Write out the queued frames and stop the writer"""
+        # A writer that died would never make room in a full queue
+        while self.thread.is_alive():
+            try:
+                self.pending.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+        if self.raw:
+            self.raw.close()
+
+# Posted by LatencyProbe; carries the perf_counter time it was posted at
+PROBE_EVENT = pygame.USEREVENT + 1
+
+class LatencyProbe:
+    """Input-to-display latency: from an input event to the first flip after the tick that used it.
+
+    Key presses are timestamped when the loop reads them, as pygame keeps
+    no event times. With post_interval set, a background thread also posts
+    PROBE_EVENT markers stamped when posted; they take the same path as a
+    key press (queue, poll, tick, draw, flip) without affecting play, so
+    their latency includes the time spent waiting in the event queue.
+    """
+
+    def __init__(self, post_interval=None):
+        self.polled = []     # (source, time) read but not yet simulated
+        self.simulated = []  # Simulated, waiting for the flip
+        self.samples = {'key': [], 'probe': []}
+        self.stopped = threading.Event()
+        self.thread = None
+        if post_interval:
+            self.thread = threading.Thread(target=self.post_markers, args=(post_interval,),
+                                           daemon=True)
+            self.thread.start()
+
+    def post_markers(self, interval):
+        jitter = random.Random()  # Keep markers out of step with the frames
+        while not self.stopped.wait(interval * jitter.uniform(0.5, 1.5)):
+            pygame.event.post(pygame.event.Event(PROBE_EVENT, time=time.perf_counter()))
+
+    def on_event(self, event):
+        if event.type == PROBE_EVENT:
+            self.polled.append(('probe', event.time))
+        elif event.type == KEYDOWN:
+            self.polled.append(('key', time.perf_counter()))
+
+    def on_tick(self):
+        self.simulated.extend(self.polled)
+        self.polled = []
+
+    def on_flip(self):
+        now = time.perf_counter()
+        for source, start in self.simulated:
+            self.samples[source].append(now - start)
+        self.simulated = []
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def report(self):
+        lines = []
+        for source, samples in self.samples.items():
+            if samples:
+                samples = sorted(samples)
+                p50, p90, p99 = (samples[min(int(q * len(samples)), len(samples) - 1)] * 1000
+                                 for q in (0.5, 0.9, 0.99))
+                lines.append(f"{source:<6}n={len(samples):<6}p50 {p50:6.2f}  p90 {p90:6.2f}  "
+                             f"p99 {p99:6.2f}  max {samples[-1] * 1000:6.2f} ms")
+        return '\n'.join(lines) or 'no input events'
+
+# Input bitmask for one simulation tick
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4       # Jump pressed this tick
+INPUT_JUMP_HELD = 8  # Jump button held down (higher jumps)
+
+# Enemies sleep until they come within ACTIVATION_MARGIN of the camera and
+# despawn once they fall DESPAWN_MARGIN behind it, as on the NES
+ACTIVATION_MARGIN = TILE_SIZE * 2
+DESPAWN_MARGIN = SCREEN_WIDTH // 2
+
+def time_of_impact(rect, dx, dy, target):
+    """When and how rect, moving by (dx, dy) over one step, first overlaps target.
+
+    Returns (time, axis): a time between 0 and 1 and the axis of entry, 0
+    for x and 1 for y, or None if they overlap from the start (time 0).
+    Returns None if they never overlap during the move.
+    """
+    entry, leave = 0.0, 1.0
+    axis = None
+    for side, (low, high, target_low, target_high, delta) in enumerate((
+            (rect.left, rect.right, target.left, target.right, dx),
+            (rect.top, rect.bottom, target.top, target.bottom, dy))):
+        if delta == 0:
+            if high <= target_low or low >= target_high:
+                return None
+        else:
+            t0 = (target_low - high) / delta
+            t1 = (target_high - low) / delta
+            if t0 > t1:
+                t0, t1 = t1, t0
+            if t0 >= entry:
+                entry, axis = t0, side
+            leave = min(leave, t1)
+            if entry >= leave:
+                return None
+    return entry, axis
+
+class LevelLayout:
+    """The sprites one load_level built, shared by every snapshot taken on that level"""
+
+    def __init__(self, level, platforms, enemies, coins, flag, level_width):
+        self.level = level
+        self.platforms = platforms  # In collision order
+        self.spans = [p for p in platforms if p.tiles is not None]
+        self.questions = [p for p in platforms if p.platform_type == 'question']
+        self.enemies = enemies  # In wake order
+        self.spawns = [enemy.rect.topleft for enemy in enemies]
+        self.enemy_index = {enemy: i for i, enemy in enumerate(enemies)}
+        self.coins = coins
+        self.flag = flag
+        self.level_width = level_width
+
+class SimState:
+    """A Simulation snapshot taken by save_state.
+
+    platforms, tiles, questions and coins stay None while the level is untouched.
+    """
+    __slots__ = ('layout', 'values', 'enemies', 'platforms', 'tiles', 'questions', 'coins')
+
+    def __init__(self, layout, values, enemies, platforms, tiles, questions, coins):
+        self.layout = layout
+        self.values = values
+        self.enemies = enemies
+        self.platforms = platforms
+        self.tiles = tiles
+        self.questions = questions
+        self.coins = coins
+
+class Simulation:
+    """Headless game core that advances exactly one tick per step().
+
+    Needs no display, font or clock, so bots and regression jobs can run it
+    under SDL_VIDEODRIVER=dummy much faster than real time. The level timer
+    counts ticks; FPS ticks make up one second of game time.
+    """
+
+    def __init__(self, world=1, level=1, width_scale=1, enemy_scale=1, enemy_physics=None,
+                 streaming=False):
+        self.start_world = world
+        self.start_level = level
+        self.width_scale = width_scale
+        self.enemy_scale = enemy_scale
+        self.streaming = streaming  # Generate levels chunk by chunk with LevelStream
         self.time_limit = 400
-        self.timer = self.time_limit
-        self.level_completed = False  # Prevent multiple completions
-        
+
         # Sprite groups
-        self.all_sprites = pygame.sprite.Group()
-        self.platforms = pygame.sprite.Group()
+        self.all_sprites = pygame.sprite.Group()  # Everything but enemies, which move separately
+        self.platforms = SpatialGroup()
         self.enemies = pygame.sprite.Group()
-        self.coins = pygame.sprite.Group()
+        self.coins = SpatialGroup()
         self.items = pygame.sprite.Group()
-        
+
         # Initialize player and flag references
         self.player = None
         self.flag = None
-        
-        # Initialize level
+
+        self.profiler = None
+        self.enemy_physics = enemy_physics  # Batched replacement for the enemy loops
+        self.shared_level = False  # Set by Population: deaths respawn without reloading the level
+        self.reset()
+
+    def reset(self):
+        """Start a new game from the starting world and level"""
+        self.current_world = self.start_world
+        self.current_level = self.start_level
+        self.score = 0
+        self.coins_collected = 0
+        self.ticks = 0
+        self.level_completed = False
+        self.game_over = False
+        self.game_won = False
         self.load_level()
-    
+
+    @property
+    def timer(self):
+        """Remaining level time in seconds"""
+        return self.timer_ticks / FPS
+
     def load_level(self):
         # Clear all sprites
         self.all_sprites.empty()
@@ -422,21 +1501,38 @@ class Game:
         self.coins.empty()
         self.items.empty()
         
-        # Generate level
-        platforms, enemies, coins, items, flag, level_width = generate_level(
-            self.current_world, self.current_level
-        )
+        if self.streaming:
+            # Start empty; the stream fills in chunks around the camera
+            self.compiled_level = None
+            self.stream = LevelStream(
+                self.current_world, self.current_level, self.width_scale, self.enemy_scale
+            )
+            platforms, enemies = SpatialGroup(), []
+            coins, items = SpatialGroup(), pygame.sprite.Group()
+            flag, level_width = self.stream.flag, self.stream.level_width
+        else:
+            # Instantiate the level from its compiled form
+            self.stream = None
+            self.compiled_level = level_cache.get(
+                self.current_world, self.current_level, self.width_scale, self.enemy_scale
+            )
+            platforms, enemies, coins, items, flag, level_width = self.compiled_level.instantiate()
         
         # Add sprites to groups
         self.platforms = platforms
-        self.enemies = enemies
+        self.enemies = pygame.sprite.Group()
+        self.sleeping_enemies = sorted(enemies, key=lambda enemy: enemy.rect.x)
+        self.next_enemy = 0
         self.coins = coins
         self.items = items
         self.flag = flag  # Store flag reference
+        self.layout = None
+        if not self.stream:
+            self.layout = LevelLayout(self.compiled_level, platforms.sprites(),
+                                      list(self.sleeping_enemies), coins.sprites(), flag, level_width)
         
         # Add all to main sprite group
         self.all_sprites.add(platforms)
-        self.all_sprites.add(enemies)
         self.all_sprites.add(coins)
         self.all_sprites.add(items)
         self.all_sprites.add(self.flag)  # Always add flag
@@ -447,14 +1543,344 @@ class Game:
         
         # Setup camera
         self.camera = Camera(level_width, SCREEN_HEIGHT)
+        if self.stream:
+            self.stream.update(self)
+        self.update_activation()
         
         # Reset timer
-        self.timer = self.time_limit
-    
-    def handle_collisions(self):
-        # Player-platform collisions
-        hits = pygame.sprite.spritecollide(self.player, self.platforms, False)
+        self.timer_ticks = self.time_limit * FPS
+        self.bricks_broken = 0
+        self.blocks_used = 0
+
+    def save_state(self):
+        """Snapshot the mutable game state for load_state.
+
+        The snapshot shares the level's sprites through its LevelLayout and
+        stores only values, so taking one costs a few tuples. Streamed
+        levels cannot be snapshotted.
+        """
+        if self.layout is None:
+            raise ValueError('streamed levels cannot be snapshotted')
+        layout = self.layout
+        player = self.player
+        values = (self.current_world, self.current_level, self.ticks, self.score,
+                  self.coins_collected, self.timer_ticks, self.level_completed, self.game_over,
+                  self.game_won, self.bricks_broken, self.blocks_used, self.next_enemy,
+                  self.camera.rect.x, player.rect.x, player.rect.y, player.vel_x, player.vel_y,
+                  player.on_ground, player.facing_right, player.lives, player.invincible,
+                  player.power_up)
+        index = layout.enemy_index
+        enemies = []
+        for enemy in self.enemies:
+            enemies += (index[enemy], enemy.rect.x, enemy.rect.y, enemy.vel_y, enemy.on_ground)
+
+        # Bricks and blocks only change once hit, coins once collected
+        platforms = tiles = questions = coins = None
+        if self.bricks_broken:
+            platforms = tuple(i for i, p in enumerate(layout.platforms) if p.alive())
+            tiles = tuple(bytes(p.tiles) for p in layout.spans)
+        if self.blocks_used:
+            questions = tuple(p.has_item for p in layout.questions)
+        if len(self.coins) != len(layout.coins):
+            coins = tuple(i for i, coin in enumerate(layout.coins) if coin.alive())
+        return SimState(layout, values, tuple(enemies), platforms, tiles, questions, coins)
+
+    def load_state(self, state):
+        """Restore a snapshot taken by save_state, touching only what differs"""
+        layout = state.layout
+        woken = self.next_enemy
+        if layout is not self.layout:
+            self.use_layout(layout)
+            woken = len(layout.enemies)
+        player = self.player
+        (self.current_world, self.current_level, self.ticks, self.score,
+         self.coins_collected, self.timer_ticks, self.level_completed, self.game_over,
+         self.game_won, self.bricks_broken, self.blocks_used, self.next_enemy,
+         self.camera.rect.x, player.rect.x, player.rect.y, player.vel_x, player.vel_y,
+         player.on_ground, player.facing_right, player.lives, player.invincible,
+         player.power_up) = state.values
+
+        # Platforms
+        if state.platforms is None:
+            alive = layout.platforms
+        else:
+            alive = [layout.platforms[i] for i in state.platforms]
+        if self.platforms.sprites() != alive:
+            # Rebuild in level order, which is also collision order
+            for platform in layout.platforms:
+                platform.kill()
+            self.platforms.add(alive)
+            self.all_sprites.add(alive)
+        for i, span in enumerate(layout.spans):
+            tiles = state.tiles[i] if state.tiles else b'\x01' * len(span.tiles)
+            if span.tiles != tiles:
+                span.tiles[:] = tiles
+                span.draw_tiles()
+        for i, block in enumerate(layout.questions):
+            has_item = state.questions[i] if state.questions else True
+            if block.has_item != has_item:
+                block.has_item = has_item
+                block.image = get_image('question', block.rect.width, block.rect.height,
+                                        None if has_item else 'used')
+
+        # Coins
+        if state.coins is None:
+            alive = layout.coins
+        else:
+            alive = [layout.coins[i] for i in state.coins]
+        if self.coins.sprites() != alive:
+            for coin in layout.coins:
+                coin.kill()
+            self.coins.add(alive)
+            self.all_sprites.add(alive)
+
+        # Enemies: awake ones from the snapshot, the rest back asleep at their spawn points
+        values = state.enemies
+        awake = [layout.enemies[values[i]] for i in range(0, len(values), 5)]
+        if self.enemies.sprites() != awake:
+            for enemy in self.enemies.sprites():
+                enemy.kill()
+            self.enemies.add(awake)
+        for i, enemy in enumerate(awake):
+            _, enemy.rect.x, enemy.rect.y, enemy.vel_y, enemy.on_ground = values[i * 5:i * 5 + 5]
+        for i in range(self.next_enemy, woken):
+            enemy = layout.enemies[i]
+            enemy.kill()
+            enemy.rect.topleft = layout.spawns[i]
+            enemy.vel_y = 0
+            enemy.on_ground = False
+        self.sleeping_enemies = layout.enemies[self.next_enemy:]
+        if self.enemy_physics:
+            self.enemy_physics.invalidate()
+
+    def use_layout(self, layout):
+        """Switch back to the sprites of an earlier load_level"""
+        self.all_sprites.empty()
+        self.platforms.empty()
+        self.enemies.empty()
+        self.coins.empty()
+        self.items.empty()
+        self.layout = layout
+        self.stream = None
+        self.compiled_level = layout.level
+        self.platforms = SpatialGroup(layout.platforms)
+        self.enemies = pygame.sprite.Group()
+        self.coins = SpatialGroup(layout.coins)
+        self.items = pygame.sprite.Group()
+        self.flag = layout.flag
+        self.all_sprites.add(layout.platforms, layout.coins, self.flag, self.player)
+        self.camera = Camera(layout.level_width, SCREEN_HEIGHT)
+
+    def step(self, inputs=0, ticks=1, world=True):
+        """Advance the game using an INPUT_* bitmask held for ticks ticks.
+
+        ticks > 1 takes one coarse step, to catch up after a hitch or to run
+        headless faster: movement is integrated tick by tick, then
+        collisions are resolved once by sweeping each rect along its path
+        (see sweep), so nothing tunnels through platforms. The result is
+        close to, but not exactly, that of ticks single steps.
+
+        world=False advances only the player, leaving the enemies to
+        Population, which moves them once for all the players of a level.
+        """
+        if self.game_over or self.game_won:
+            return
+        if self.level_completed:
+            self.advance_level()
+            if self.game_won:
+                return
+        self.ticks += ticks
+        coarse = ticks > 1
+        player_start = enemy_starts = player_vel_y = None
+        if coarse:
+            player_start = self.player.rect.copy()
+            enemy_starts = {enemy: enemy.rect.copy() for enemy in self.enemies}
+            player_vel_y = []  # Per tick, to tell which way the player moved at a contact
+
+        for tick in range(ticks):
+            # Apply input
+            if inputs & INPUT_JUMP and tick == 0:
+                self.player.jump()
+            if inputs & INPUT_LEFT:
+                self.player.move_left()
+            if inputs & INPUT_RIGHT:
+                self.player.move_right()
+            if inputs & INPUT_JUMP_HELD and self.player.vel_y < -5:
+                # Allow higher jumps by holding jump button
+                self.player.vel_y -= 0.5
+
+            # Update; platforms, coins and the flag never move on their own
+            self.player.update()
+            if coarse:
+                player_vel_y.append(self.player.vel_y)
+            if world:
+                if self.enemy_physics and not coarse:
+                    self.enemy_physics.move(self)
+                else:
+                    self.enemies.update()
+        self.camera.update(self.player)
+        if self.stream:
+            self.stream.update(self)
+        if world:
+            self.update_activation()
+        if self.profiler:
+            self.profiler.lap(PHASE_UPDATE)
+        self.handle_collisions(player_start, enemy_starts, enemies=world,
+                               player_vel_y=player_vel_y)
+        if self.level_completed or self.game_over:
+            return
+
+        # Update timer
+        self.timer_ticks -= ticks
+        if self.timer_ticks <= 0:
+            self.player_death()
+
+        # Check if player fell off the map
+        if not self.game_over and self.player.rect.top > SCREEN_HEIGHT:
+            self.player_death()
+
+        # Prevent player from going too far past the level end
+        if self.player.rect.x > self.camera.width:
+            self.player.rect.x = self.camera.width
+
+    def update_activation(self, view=None):
+        """Wake sleeping enemies near the camera (or view) and despawn those left behind"""
+        if view is None:
+            view = self.camera.view
+        sleeping = self.sleeping_enemies
+        wake_x = view.right + ACTIVATION_MARGIN
+        woken = 0
+        while woken < len(sleeping) and sleeping[woken].rect.x < wake_x:
+            self.enemies.add(sleeping[woken])
+            woken += 1
+        if woken:
+            del sleeping[:woken]
+            self.next_enemy += woken
+
+        despawn_x = view.left - DESPAWN_MARGIN
+        for enemy in self.enemies.sprites():
+            if enemy.rect.right < despawn_x:
+                enemy.kill()
+
+    def state_hash(self):
+        """CRC32 of the mutable simulation state, for replay divergence checks"""
+        player = self.player
+        state = [self.ticks, self.current_world, self.current_level, self.score,
+                 self.coins_collected, self.timer_ticks, self.level_completed,
+                 self.game_over, self.game_won, self.camera.rect.x,
+                 player.rect.x, player.rect.y, player.vel_x, player.vel_y,
+                 player.on_ground, player.lives, player.invincible, player.power_up,
+                 len(self.coins), self.bricks_broken, self.blocks_used, self.next_enemy]
+        for enemy in self.enemies:
+            state += (enemy.rect.x, enemy.rect.y, enemy.vel_x, enemy.vel_y)
+        return zlib.crc32(repr(state).encode())
+
+    def sweep(self, start, end):
+        """Contacts of a rect moving from start to end, by time of first contact.
+
+        Each is (time, axis, platform, rect) as from time_of_impact, rect
+        being the tile hit for merged runs and the platform's rect otherwise.
+        """
+        dx, dy = end.x - start.x, end.y - start.y
+        area = start.union(end)
+        found = []
+        for platform in self.platforms.query(area):
+            if platform.tiles is None:
+                targets = [platform.rect]
+            else:
+                # Only the intact tiles of a merged run
+                rect, width = platform.rect, platform.tile_width
+                targets = [pygame.Rect(rect.x + i * width, rect.y, width, rect.height)
+                           for i in platform.intact_tiles(area)]
+            contacts = []
+            for target in targets:
+                contact = time_of_impact(start, dx, dy, target)
+                if contact is not None:
+                    contacts.append((contact[0], contact[1], target))
+            if contacts:
+                when, axis, target = min(contacts, key=lambda contact: contact[0])
+                found.append((when, axis, platform, target))
+        # Stable, so platforms hit at the same time stay in collision order
+        found.sort(key=lambda contact: contact[0])
+        return found
+
+    def resolve_sweep(self, start, vel_y):
+        """Stop the player at its first contacts along a coarse step; False if it died.
+
+        vel_y is the player's vertical speed after each tick, so a contact is
+        resolved by how the player was moving when it happened. Platforms
+        already overlapped at start are passed through.
+        """
+        player = self.player
+        rect = player.rect
+        vertical = True  # Until a landing or bump stops the vertical motion
+        for _ in range(2):
+            contacts = [contact for contact in self.sweep(start, rect) if contact[1] is not None]
+            if not contacts:
+                break
+            when, axis, hit, target = contacts[0]
+            if hit.platform_type == 'lava':
+                self.player_death()
+                return False
+            if vertical and vel_y[min(int(when * len(vel_y)), len(vel_y) - 1)] > 0:
+                rect.bottom = target.top
+                player.vel_y = 0
+                player.on_ground = True
+                vertical = False
+            elif vertical and axis == 1:
+                self.bump(hit, None if hit.tiles is None else (target.x - hit.rect.x) // hit.tile_width)
+                rect.top = target.bottom
+                player.vel_y = 0
+                vertical = False
+            elif axis == 0:
+                if rect.x > start.x:
+                    rect.right = target.left
+                else:
+                    rect.left = target.right
+                player.vel_x = 0
+            else:
+                break
+        return True
+
+    def bump(self, hit, tile):
+        """A block hit from below: release its item, or break it (tile of a merged run) when big"""
+        if hit.has_item:
+            # Release item from question block
+            hit.has_item = False
+            hit.image = get_image('question', hit.rect.width, hit.rect.height, 'used')
+            self.blocks_used += 1
+            self.score = int(self.score + 100)
+            # Could add mushroom/flower here
+        elif hit.breakable and self.player.power_up > 0:
+            # Break brick
+            if tile is None:
+                hit.kill()
+            else:
+                hit.break_tile(tile)
+            self.bricks_broken += 1
+            self.score = int(self.score + 50)
+
+    def handle_collisions(self, player_start=None, enemy_starts=None, enemies=True,
+                          player_vel_y=None):
+        """Resolve contacts after a step; the start rects are given for coarse steps.
+
+        enemies=False leaves out landing the enemies on platforms.
+        """
+        # Player-platform collisions (only the grid cells the player overlaps)
+        if player_start is None:
+            hits = self.platforms.collide(self.player)
+            area = self.player.rect
+        else:
+            hits = []
+            area = player_start.union(self.player.rect)
+            path = self.player.rect.copy()
+            if not self.resolve_sweep(player_start, player_vel_y):
+                return
         for hit in hits:
+            if hit.tiles is not None:
+                tiles = hit.intact_tiles(area)
+                if not tiles:
+                    continue  # Only broken tiles of a merged run
             if hit.platform_type == 'lava':
                 self.player_death()
                 return
@@ -466,33 +1892,37 @@ class Game:
                     self.player.on_ground = True
             elif self.player.vel_y < 0:  # Jumping up
                 if self.player.rect.top < hit.rect.bottom:
-                    if hit.has_item:
-                        # Release item from question block
-                        hit.has_item = False
-                        hit.image.fill(CASTLE_GRAY)
-                        self.score = int(self.score + 100)
-                        # Could add mushroom/flower here
-                    elif hit.breakable and self.player.power_up > 0:
-                        # Break brick
-                        hit.kill()
-                        self.score = int(self.score + 50)
+                    self.bump(hit, None if hit.tiles is None else tiles[0])
                     self.player.rect.top = hit.rect.bottom
                     self.player.vel_y = 0
         
         # Enemy-platform collisions
-        for enemy in self.enemies:
-            hits = pygame.sprite.spritecollide(enemy, self.platforms, False)
-            for hit in hits:
-                if enemy.vel_y > 0:
-                    enemy.rect.bottom = hit.rect.top
-                    enemy.vel_y = 0
-                    enemy.on_ground = True
+        if enemies:
+            if self.enemy_physics and enemy_starts is None:
+                self.enemy_physics.land(self)
+            else:
+                self.land_enemies(enemy_starts)
+                if self.enemy_physics:
+                    self.enemy_physics.invalidate()
         
-        # Player-enemy collisions
+        # Player-enemy collisions, as they were met along the path for coarse steps
         if self.player.invincible <= 0:
             enemy_hits = pygame.sprite.spritecollide(self.player, self.enemies, False)
+            stomps = []
+            if player_start is not None:
+                # Enemies the player came down on during the step, though it may have landed since
+                dx, dy = path.x - player_start.x, path.y - player_start.y
+                for enemy in self.enemies:
+                    contact = time_of_impact(player_start, dx, dy, enemy.rect)
+                    if contact is not None and contact[1] == 1:
+                        when = contact[0]
+                        tick = min(int(when * len(player_vel_y)), len(player_vel_y) - 1)
+                        if player_vel_y[tick] > 0 and player_start.bottom + when * dy < enemy.rect.centery:
+                            stomps.append(enemy)
+                enemy_hits = [enemy for enemy in enemy_hits if enemy not in stomps] + stomps
             for enemy in enemy_hits:
-                if self.player.vel_y > 0 and self.player.rect.bottom < enemy.rect.centery:
+                if enemy in stomps or (self.player.vel_y > 0 and
+                                       self.player.rect.bottom < enemy.rect.centery):
                     # Stomp enemy
                     enemy.kill()
                     self.score = int(self.score + 100)
@@ -505,8 +1935,13 @@ class Game:
                     else:
                         self.player_death()
         
-        # Player-coin collisions
-        coin_hits = pygame.sprite.spritecollide(self.player, self.coins, True)
+        # Player-coin collisions, along the whole path for coarse steps
+        if player_start is None:
+            coin_hits = self.coins.collide(self.player)
+        else:
+            coin_hits = self.coins.query(area)
+        for coin in coin_hits:
+            coin.kill()
         for coin in coin_hits:
             self.score = int(self.score + 10)
             self.coins_collected += 1
@@ -516,166 +1951,680 @@ class Game:
         
         # Player-flag collision
         if hasattr(self, 'flag') and self.flag is not None:
-            if self.player.rect.colliderect(self.flag.rect):
-                self.level_complete()
+            if area.colliderect(self.flag.rect):
+                self.level_completed = True
     
+    def land_enemies(self, starts=None):
+        for enemy in self.enemies:
+            # Enemies woken during a coarse step have no start rect
+            start = starts.get(enemy) if starts else None
+            if start is None:
+                hits = self.platforms.collide(enemy)
+            else:
+                hits = [contact[2] for contact in self.sweep(start, enemy.rect)]
+            for hit in hits:
+                if start is None and hit.tiles is not None and not hit.intact_tiles(enemy.rect):
+                    continue
+                if enemy.vel_y > 0:
+                    enemy.rect.bottom = hit.rect.top
+                    enemy.vel_y = 0
+                    enemy.on_ground = True
+
     def player_death(self):
         self.player.lives -= 1
         if self.player.lives <= 0:
-            self.game_over()
+            self.game_over = True
+        elif self.shared_level:
+            self.respawn()
         else:
             self.load_level()
-    
-    def level_complete(self):
-        # Play a simple victory animation
-        for i in range(30):  # Brief pause for victory
-            # Process events to keep window responsive
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    self.running = False
-                    return
-            
-            self.clock.tick(FPS)
-            # Draw victory frame
-            if self.current_world == 2:
-                self.screen.fill(BLACK)
-            elif self.current_world == 3:
-                self.screen.fill((135, 206, 235))
-            elif self.current_world == 4 or self.current_world == 8:
-                self.screen.fill((50, 50, 50))
-            else:
-                self.screen.fill(SKY)
-            
-            for sprite in self.all_sprites:
-                self.screen.blit(sprite.image, self.camera.apply(sprite))
-            
-            # Show "LEVEL COMPLETE!" message
-            complete_text = self.font.render("LEVEL COMPLETE!", True, COIN_YELLOW)
-            self.screen.blit(complete_text, (SCREEN_WIDTH//2 - complete_text.get_width()//2, SCREEN_HEIGHT//2))
-            pygame.display.flip()
-        
-        # Award time bonus
+
+    def respawn(self):
+        """Start the player over as load_level would, but keep the level as it is"""
+        self.player.kill()
+        self.player = Player(TILE_SIZE * 2, SCREEN_HEIGHT - TILE_SIZE * 4)
+        self.all_sprites.add(self.player)
+        self.camera.rect.x = 0
+        self.timer_ticks = self.time_limit * FPS
+
+    def advance_level(self):
+        """Award the time bonus and progress to the next level"""
+        self.level_completed = False
         self.score = int(self.score + int(self.timer) * 10)
-        
-        # Progress to next level
+
         self.current_level += 1
         if self.current_level > 4:
             self.current_level = 1
             self.current_world += 1
             if self.current_world > 8:
-                self.game_complete()
+                self.game_won = True
                 return
-        
+
         self.load_level()
-    
-    def game_over(self):
-        # Display game over screen
-        self.screen.fill(BLACK)
-        text = self.font.render("GAME OVER", True, WHITE)
-        score_text = self.small_font.render(f"Final Score: {self.score}", True, WHITE)
-        self.screen.blit(text, (SCREEN_WIDTH//2 - text.get_width()//2, SCREEN_HEIGHT//2 - 50))
-        self.screen.blit(score_text, (SCREEN_WIDTH//2 - score_text.get_width()//2, SCREEN_HEIGHT//2))
-        pygame.display.flip()
-        pygame.time.wait(3000)
-        self.__init__()  # Restart game
-    
-    def game_complete(self):
-        # Display victory screen
-        self.screen.fill(BLACK)
-        text = self.font.render("CONGRATULATIONS!", True, COIN_YELLOW)
-        text2 = self.font.render("YOU SAVED THE PRINCESS!", True, WHITE)
-        score_text = self.small_font.render(f"Final Score: {self.score}", True, WHITE)
-        self.screen.blit(text, (SCREEN_WIDTH//2 - text.get_width()//2, SCREEN_HEIGHT//2 - 100))
-        self.screen.blit(text2, (SCREEN_WIDTH//2 - text2.get_width()//2, SCREEN_HEIGHT//2 - 50))
-        self.screen.blit(score_text, (SCREEN_WIDTH//2 - score_text.get_width()//2, SCREEN_HEIGHT//2))
-        pygame.display.flip()
-        pygame.time.wait(5000)
-        self.running = False
-    
-    def draw_hud(self):
-        # Score
-        score_text = self.small_font.render(f"SCORE: {int(self.score):06d}", True, WHITE)
-        self.screen.blit(score_text, (10, 10))
+
+# Input recordings: header, run-length encoded input masks, state hashes
+RECORDING_MAGIC = b'SMBR'
+RECORDING_VERSION = 3
+RECORDING_HEADER = struct.Struct('<4sBBBHHH')
+
+class Population:
+    """Many agents playing the same level on one Simulation.
+
+    Each agent is a SimState, about 1 KB of tuples, kept unpacked so that
+    loading it every tick stays cheap. With shared_world=True the agents
+    instead share one world's enemies, coins and bricks, and keep only
+    their player, score, timer and camera.
+    """
+
+    def __init__(self, count, world=1, level=1, shared_world=False, **options):
+        if options.get('streaming'):
+            raise ValueError('streamed levels cannot be shared between agents')
+        self.sim = Simulation(world, level, **options)
+        self.count = count
+        self.shared_world = shared_world
+        start = self.sim.save_state()
+        self.layouts = {(world, level): start.layout}
+        if shared_world:
+            self.sim.shared_level = True
+            self.agents = [self.player_values()] * count
+        else:
+            self.agents = [start] * count
+
+    def player_values(self):
+        sim = self.sim
+        player = sim.player
+        return (sim.ticks, sim.score, sim.coins_collected, sim.timer_ticks, sim.level_completed,
+                sim.game_over, sim.camera.rect.x, player.rect.x, player.rect.y, player.vel_x,
+                player.vel_y, player.on_ground, player.facing_right, player.lives,
+                player.invincible, player.power_up)
+
+    def load_player(self, values):
+        sim = self.sim
+        player = sim.player
+        (sim.ticks, sim.score, sim.coins_collected, sim.timer_ticks, sim.level_completed,
+         sim.game_over, sim.camera.rect.x, player.rect.x, player.rect.y, player.vel_x,
+         player.vel_y, player.on_ground, player.facing_right, player.lives,
+         player.invincible, player.power_up) = values
+
+    def finished(self, index):
+        agent = self.agents[index]
+        if self.shared_world:
+            return agent[4] or agent[5]
+        return agent.values[7] or agent.values[8]
+
+    def select(self, index):
+        """Load agent index into sim, to inspect or draw it; returns sim"""
+        if self.shared_world:
+            self.load_player(self.agents[index])
+        else:
+            self.sim.load_state(self.agents[index])
+        return self.sim
+
+    def step(self, inputs):
+        """Advance every unfinished agent one tick; inputs holds one INPUT_* bitmask per agent"""
+        if self.shared_world:
+            self.step_shared(inputs)
+            return
+        sim = self.sim
+        agents = self.agents
+        for i, agent in enumerate(agents):
+            if self.finished(i):
+                continue
+            sim.load_state(agent)
+            sim.step(inputs[i])
+            state = sim.save_state()
+            # Instantiated layouts of a level match index for index
+            state.layout = self.layouts.setdefault((sim.current_world, sim.current_level),
+                                                   state.layout)
+            agents[i] = state
+
+    def step_shared(self, inputs):
+        sim = self.sim
+        agents = self.agents
+        # The shared enemies move once, before the players meet them as in Simulation.step
+        if sim.enemy_physics:
+            sim.enemy_physics.move(sim)
+            sim.enemy_physics.land(sim)
+        else:
+            sim.enemies.update()
+            sim.land_enemies()
+        left = right = None
+        for i, agent in enumerate(agents):
+            if self.finished(i):
+                continue
+            self.load_player(agent)
+            sim.step(inputs[i], world=False)
+            agents[i] = self.player_values()
+            x = sim.camera.rect.x
+            left = x if left is None else min(left, x)
+            right = x if right is None else max(right, x)
+        # Wake enemies ahead of the leading agent, despawn them behind the last
+        if left is not None:
+            sim.update_activation(pygame.Rect(left, 0, right - left + SCREEN_WIDTH, SCREEN_HEIGHT))
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+class ReplayDivergence(Exception):
+    pass
+
+class InputRecorder:
+    """Records the INPUT_* mask of every tick plus periodic state hashes.
+
+    Masks are stored as (mask, run length) pairs, so holding a direction
+    for seconds costs a couple of bytes. A hash of the simulation state is
+    kept every hash_interval ticks so replays can detect divergence.
+    """
+
+    def __init__(self, sim, hash_interval=1):
+        self.world = sim.start_world
+        self.level = sim.start_level
+        self.width_scale = sim.width_scale
+        self.enemy_scale = sim.enemy_scale
+        self.hash_interval = hash_interval
+        self.runs = []  # [mask, count] pairs
+        self.hashes = array('I')
+        self.ticks = 0
+
+    def record(self, inputs, sim):
+        """Call once after every Simulation.step"""
+        if self.runs and self.runs[-1][0] == inputs:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([inputs, 1])
+        self.ticks += 1
+        if self.ticks % self.hash_interval == 0:
+            self.hashes.append(sim.state_hash())
+
+    def save(self, path):
+        out = bytearray(RECORDING_HEADER.pack(
+            RECORDING_MAGIC, RECORDING_VERSION, self.world, self.level,
+            self.width_scale, self.enemy_scale, self.hash_interval))
+        write_varint(out, len(self.runs))
+        for mask, count in self.runs:
+            out.append(mask)
+            write_varint(out, count)
+        write_varint(out, len(self.hashes))
+        out += struct.pack(f'<{len(self.hashes)}I', *self.hashes)
+        with open(path, 'wb') as f:
+            f.write(out)
+
+def load_recording(path):
+    """Return (header dict, list of (mask, count) runs, list of hashes)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, world, level, width_scale, enemy_scale, hash_interval = \
+        RECORDING_HEADER.unpack_from(data)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise ValueError(f"{path} is not a version {RECORDING_VERSION} recording")
+    pos = RECORDING_HEADER.size
+    n_runs, pos = read_varint(data, pos)
+    runs = []
+    for _ in range(n_runs):
+        mask = data[pos]
+        count, pos = read_varint(data, pos + 1)
+        runs.append((mask, count))
+    n_hashes, pos = read_varint(data, pos)
+    hashes = list(struct.unpack_from(f'<{n_hashes}I', data, pos))
+    header = {'world': world, 'level': level, 'width_scale': width_scale,
+              'enemy_scale': enemy_scale, 'hash_interval': hash_interval}
+    return header, runs, hashes
+
+def replay(path):
+    """Replay a recording headlessly at full speed.
+
+    Yields (tick, state hash) after every tick and raises ReplayDivergence
+    at the first recorded hash that does not match.
+    """
+    header, runs, hashes = load_recording(path)
+    sim = Simulation(header['world'], header['level'],
+                     header['width_scale'], header['enemy_scale'])
+    interval = header['hash_interval']
+    tick = 0
+    for mask, count in runs:
+        for _ in range(count):
+            sim.step(mask)
+            tick += 1
+            state_hash = sim.state_hash()
+            if tick % interval == 0:
+                expected = hashes[tick // interval - 1]
+                if state_hash != expected:
+                    raise ReplayDivergence(
+                        f"tick {tick}: state hash {state_hash:08x}, recorded {expected:08x}")
+            yield tick, state_hash
+            # Mirror Game: a game over restarts straight away
+            if sim.game_over:
+                sim.reset()
+
+# Transition scenes shown between levels, and how many frames each lasts
+SCENE_FRAMES = {'level_complete': 30, 'game_over': 3 * FPS, 'game_complete': 5 * FPS}
+
+# With a separate render rate the simulation still runs FPS ticks a second;
+# under load up to MAX_FRAME_SKIP ticks run between two drawn frames, and
+# ticks still owed after that carry over instead of being dropped
+TICK_SECONDS = 1 / FPS
+MAX_FRAME_SKIP = 5
+
+class Game:
+    """Display and keyboard shell around a Simulation; the options match the command line.
+
+    Level transitions are scenes run by the main loop like normal frames.
+    """
+
+    def __init__(self, profile=False, profile_csv=None, record=None, dirty_rects=False,
+                 scene_frames=None, render_fps=None, low_latency=False, spin_wait=False,
+                 latency_probe=False, capture=None, resolution=None, upscale='scale'):
+        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption('Super Mario Bros - 32 Levels')
+        image_cache.clear()  # Redraw shared images in the display pixel format
+        self.clock = pygame.time.Clock()
+        self.running = True
         
-        # Coins
-        coin_text = self.small_font.render(f"COINS: {self.coins_collected:02d}", True, COIN_YELLOW)
-        self.screen.blit(coin_text, (10, 40))
+        # Everything is drawn onto the canvas: the window, or a smaller surface
+        # upscaled to it by present()
+        if upscale not in ('scale', 'smooth', 'integer'):
+            raise ValueError(f"unknown upscale mode {upscale!r}")
+        self.upscale = upscale
+        self.canvas = self.screen
+        self.upscale_area = self.screen
+        if resolution and tuple(resolution) != (SCREEN_WIDTH, SCREEN_HEIGHT):
+            self.canvas = display_format(pygame.Surface(resolution))
+            factor = min(SCREEN_WIDTH // resolution[0], SCREEN_HEIGHT // resolution[1])
+            if upscale == 'integer' and factor >= 1:
+                area = pygame.Rect(0, 0, resolution[0] * factor, resolution[1] * factor)
+                area.center = self.screen.get_rect().center
+                self.screen.fill(BLACK)
+                self.upscale_area = self.screen.subsurface(area)
+        text_scale = self.canvas.get_height() / SCREEN_HEIGHT
+        self.font = pygame.font.Font(None, max(8, round(36 * text_scale)))
+        self.small_font = pygame.font.Font(None, max(8, round(24 * text_scale)))
         
-        # World-Level
-        level_text = self.small_font.render(f"WORLD {self.current_world}-{self.current_level}", True, WHITE)
-        self.screen.blit(level_text, (SCREEN_WIDTH//2 - 50, 10))
+        # Game state lives in the headless simulation core
+        self.sim = Simulation()
+        self.renderer = Renderer(self.canvas)
+        self.dirty_rects = dirty_rects  # Repaint only changed regions of the canvas
+        self.hud = Hud(self.small_font)
         
-        # Timer
-        timer_text = self.small_font.render(f"TIME: {int(self.timer)}", True, WHITE)
-        self.screen.blit(timer_text, (SCREEN_WIDTH - 120, 10))
+        # Transition scenes; headless runs never wait on them
+        if pygame.display.get_driver() == 'dummy':
+            self.scene_frames = dict.fromkeys(SCENE_FRAMES, 0)
+        else:
+            self.scene_frames = dict(SCENE_FRAMES)
+        self.scene_frames.update(scene_frames or {})
+        self.scene = 'play'
+        self.scene_left = 0
+        
+        # Fixed-rate simulation decoupled from the render rate
+        self.render_fps = render_fps
+        self.interpolator = Interpolator() if render_fps is not None else None
+        self.lag = 0.0  # Simulation time owed, in seconds
+        self.pending_inputs = 0  # Jump presses waiting for the next tick
+        self.late_frames = 0  # Frames drawn with ticks still owed
+        
+        # Low-latency pacing and input-to-display measurement
+        self.pacer = None
+        if low_latency:
+            self.pacer = FramePacer(FPS if render_fps is None else render_fps, spin_wait)
+        self.latency_probe = LatencyProbe(post_interval=0.1) if latency_probe else None
+        self.capture = capture
+        
+        # Optional frame-time profiling (F3 toggles the overlay)
+        self.profiler = None
+        self.profile_csv = profile_csv
+        self.show_profile = False
+        self.profile_overlay = None
+        if profile or profile_csv:
+            self.set_profiling(True)
+        self.show_profile = profile
+        
+        # Optional input recording for deterministic replays
+        self.record_path = record
+        self.recorder = InputRecorder(self.sim) if record else None
+
+    def set_profiling(self, enabled):
+        if enabled and self.profiler is None:
+            self.profiler = FrameProfiler()
+        elif not enabled:
+            self.profiler = None
+        self.sim.profiler = self.renderer.profiler = self.profiler
+
+    def toggle_profile_overlay(self):
+        self.show_profile = not self.show_profile
+        self.profile_overlay = None
+        self.renderer.invalidate()
+        # Keep collecting when a CSV dump was requested
+        self.set_profiling(self.show_profile or bool(self.profile_csv))
+
+    def draw_profile_overlay(self):
+        profiler = self.profiler
+        # Percentiles are refreshed twice a second rather than every frame
+        if self.profile_overlay is None or profiler.count % (FPS // 2) == 0:
+            stats = profiler.percentiles(0.5, 0.99)
+            lines = [f"{name:<11}p50 {p50:6.2f}  p99 {p99:6.2f} ms"
+                     for name, (p50, p99) in stats.items()]
+            overlay = pygame.Surface((260, 20 * len(lines) + 10))
+            overlay.set_alpha(180)
+            for i, line in enumerate(lines):
+                overlay.blit(self.small_font.render(line, True, WHITE), (5, 5 + 20 * i))
+            self.profile_overlay = overlay
+        # Inside the upscaled area, which present() repaints, never the letterbox around it
+        self.upscale_area.blit(self.profile_overlay, (10, 70))
+
+    def layout(self, x, y):
+        """Canvas position of a point laid out for an 800x600 screen"""
+        return (x * self.canvas.get_width() // SCREEN_WIDTH,
+                y * self.canvas.get_height() // SCREEN_HEIGHT)
+
+    def blit_centered(self, text, y):
+        x, y = self.layout(SCREEN_WIDTH // 2, y)
+        self.canvas.blit(text, (x - text.get_width() // 2, y))
+
+    def present(self, dirty):
+        """Upscale the canvas to the window; returns the window areas to update"""
+        if self.canvas is self.screen:
+            return dirty
+        area = self.upscale_area
+        if self.upscale == 'smooth':
+            pygame.transform.smoothscale(self.canvas, area.get_size(), area)
+        else:
+            pygame.transform.scale(self.canvas, area.get_size(), area)
+        return None
+
+    def read_inputs(self):
+        """Poll events and the keyboard into an INPUT_* bitmask"""
+        inputs = 0
+        for event in pygame.event.get():
+            if self.latency_probe:
+                self.latency_probe.on_event(event)
+            if event.type == QUIT:
+                self.running = False
+            elif event.type == KEYDOWN:
+                if event.key == K_SPACE or event.key == K_UP:
+                    inputs |= INPUT_JUMP
+                elif event.key == K_ESCAPE:
+                    self.running = False
+                elif event.key == K_F3:
+                    self.toggle_profile_overlay()
         
-        # Lives
-        lives_text = self.small_font.render(f"LIVES: {self.player.lives}", True, WHITE)
-        self.screen.blit(lives_text, (SCREEN_WIDTH - 120, 40))
+        # Handle continuous input
+        keys = pygame.key.get_pressed()
+        if keys[K_LEFT] or keys[K_a]:
+            inputs |= INPUT_LEFT
+        if keys[K_RIGHT] or keys[K_d]:
+            inputs |= INPUT_RIGHT
+        if keys[K_SPACE] or keys[K_UP] or keys[K_w]:
+            inputs |= INPUT_JUMP_HELD
+        return inputs
+
+    def draw_world(self):
+        self.renderer.draw_world(self.sim)
+
+    def save_state(self):
+        """Snapshot the game for rewinding or search; see Simulation.save_state"""
+        return self.sim.save_state()
+
+    def load_state(self, state):
+        self.sim.load_state(state)
+        self.renderer.invalidate()
+    
+    def start_scene(self, scene):
+        self.scene = scene
+        self.scene_left = self.scene_frames.get(scene, 0)
+        if scene != 'play' and self.scene_left <= 0:
+            self.end_scene()
+
+    def end_scene(self):
+        scene = self.scene
+        self.renderer.invalidate()
+        if scene == 'level_complete':
+            # Award time bonus and progress to next level
+            self.sim.advance_level()
+            self.start_scene('game_complete' if self.sim.game_won else 'play')
+        elif scene == 'game_over':
+            self.sim.reset()  # Restart game
+            self.start_scene('play')
+        elif scene == 'game_complete':
+            self.running = False
+
+    def update_scene(self):
+        """Count down the current transition scene by one frame"""
+        self.scene_left -= 1
+        if self.scene_left <= 0:
+            self.end_scene()
+
+    def draw_scene(self):
+        if self.scene == 'level_complete':
+            # Victory frame
+            self.draw_world()
+            complete_text = self.hud.text(self.font, "LEVEL COMPLETE!", COIN_YELLOW)
+            self.blit_centered(complete_text, SCREEN_HEIGHT//2)
+        elif self.scene == 'game_over':
+            self.canvas.fill(BLACK)
+            text = self.hud.text(self.font, "GAME OVER", WHITE)
+            score_text = self.hud.text(self.small_font, f"Final Score: {self.sim.score}", WHITE)
+            self.blit_centered(text, SCREEN_HEIGHT//2 - 50)
+            self.blit_centered(score_text, SCREEN_HEIGHT//2)
+        elif self.scene == 'game_complete':
+            self.canvas.fill(BLACK)
+            text = self.hud.text(self.font, "CONGRATULATIONS!", COIN_YELLOW)
+            text2 = self.hud.text(self.font, "YOU SAVED THE PRINCESS!", WHITE)
+            score_text = self.hud.text(self.small_font, f"Final Score: {self.sim.score}", WHITE)
+            self.blit_centered(text, SCREEN_HEIGHT//2 - 100)
+            self.blit_centered(text2, SCREEN_HEIGHT//2 - 50)
+            self.blit_centered(score_text, SCREEN_HEIGHT//2)
     
+    def hud_fields(self):
+        sim = self.sim
+        return (
+            ("SCORE: ", f"{int(sim.score):06d}", WHITE, self.layout(10, 10)),
+            ("COINS: ", f"{sim.coins_collected:02d}", COIN_YELLOW, self.layout(10, 40)),
+            ("WORLD ", f"{sim.current_world}-{sim.current_level}", WHITE, self.layout(SCREEN_WIDTH//2 - 50, 10)),
+            ("TIME: ", f"{int(sim.timer)}", WHITE, self.layout(SCREEN_WIDTH - 120, 10)),
+            ("LIVES: ", f"{sim.player.lives}", WHITE, self.layout(SCREEN_WIDTH - 120, 40)),
+        )
+    
+    def draw_hud(self):
+        self.hud.update(self.hud_fields())
+        self.hud.draw(self.canvas)
+    
+    def draw_dirty(self):
+        """Repaint changed regions only; returns them, or None after a full redraw"""
+        dirty = self.renderer.draw_world_dirty(self.sim, self.hud.update(self.hud_fields()))
+        if dirty is None:
+            self.hud.draw(self.canvas)
+        else:
+            self.hud.draw(self.canvas, dirty)
+        return dirty
+    
+    def update(self, inputs):
+        """Run one tick of the simulation or the current scene"""
+        if self.scene == 'play':
+            self.sim.step(inputs)
+            if self.profiler:
+                # Per tick, as step laps the update: several ticks may run in one frame
+                self.profiler.lap(PHASE_COLLISIONS)
+            if self.recorder:
+                self.recorder.record(inputs, self.sim)
+            if self.sim.level_completed:
+                self.start_scene('level_complete')
+            elif self.sim.game_over:
+                self.start_scene('game_over')
+            elif self.sim.game_won:
+                self.start_scene('game_complete')
+        else:
+            self.update_scene()
+        if self.latency_probe:
+            self.latency_probe.on_tick()
+
+    def update_fixed(self, inputs):
+        """Run the ticks that are due; returns how far the next one is, 0 to 1"""
+        self.lag += self.clock.get_time() / 1000
+        # A jump pressed between ticks goes to the next one, and only that one
+        self.pending_inputs |= inputs & INPUT_JUMP
+        inputs &= ~INPUT_JUMP
+        ticks = 0
+        while self.lag >= TICK_SECONDS and ticks < MAX_FRAME_SKIP and self.running:
+            self.interpolator.capture(self.sim)
+            self.update(inputs | self.pending_inputs)
+            self.pending_inputs = 0
+            self.lag -= TICK_SECONDS
+            ticks += 1
+        if self.lag >= TICK_SECONDS:
+            self.late_frames += 1
+        return min(self.lag / TICK_SECONDS, 1.0)
+
     def run(self):
         while self.running:
-            dt = self.clock.tick(FPS) / 1000.0
+            if self.pacer:
+                self.pacer.wait()
+                self.clock.tick()  # Only measures the frame time
+            else:
+                self.clock.tick(FPS if self.interpolator is None else self.render_fps)
+            prof = self.profiler
+            if prof:
+                prof.begin_frame()
             
-            # Handle events
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    self.running = False
-                elif event.type == KEYDOWN:
-                    if event.key == K_SPACE or event.key == K_UP:
-                        self.player.jump()
-                    elif event.key == K_ESCAPE:
-                        self.running = False
-            
-            # Handle continuous input
-            keys = pygame.key.get_pressed()
-            if keys[K_LEFT] or keys[K_a]:
-                self.player.move_left()
-            if keys[K_RIGHT] or keys[K_d]:
-                self.player.move_right()
-            if (keys[K_SPACE] or keys[K_UP] or keys[K_w]) and self.player.vel_y < -5:
-                # Allow higher jumps by holding jump button
-                self.player.vel_y -= 0.5
+            # Handle events and continuous input
+            inputs = self.read_inputs()
+            if prof:
+                prof.lap(PHASE_EVENTS)
             
             # Update
-            self.all_sprites.update()
-            self.camera.update(self.player)
-            self.handle_collisions()
-            
-            # Update timer
-            self.timer -= dt
-            if self.timer <= 0:
-                self.player_death()
+            if self.interpolator is None:
+                self.update(inputs)
+            else:
+                alpha = self.update_fixed(inputs)
+            if prof:
+                prof.lap(PHASE_COLLISIONS)
+            if not self.running:
+                break
             
             # Draw
-            if self.current_world == 2:  # Underground
-                self.screen.fill(BLACK)
-            elif self.current_world == 3:  # Sky
-                self.screen.fill((135, 206, 235))  # Sky blue
-            elif self.current_world == 4 or self.current_world == 8:  # Castle
-                self.screen.fill((50, 50, 50))  # Dark gray
+            if self.interpolator and self.scene == 'play':
+                self.interpolator.blend(self.sim, alpha)
+            dirty = None
+            if self.scene != 'play':
+                self.draw_scene()
+            elif self.dirty_rects and not self.show_profile:
+                dirty = self.draw_dirty()
             else:
-                self.screen.fill(SKY)
-            
-            # Draw all sprites with camera offset
-            for sprite in self.all_sprites:
-                self.screen.blit(sprite.image, self.camera.apply(sprite))
-            
-            # Draw HUD
-            self.draw_hud()
-            
-            # Check if player fell off the map
-            if self.player.rect.top > SCREEN_HEIGHT:
-                self.player_death()
-            
-            # Prevent player from going too far past the level end
-            if hasattr(self, 'camera') and self.player.rect.x > self.camera.width:
-                self.player.rect.x = self.camera.width
-            
-            pygame.display.flip()
+                self.draw_world()
+                self.draw_hud()
+            if prof:
+                prof.lap(PHASE_HUD)
+            if self.interpolator:
+                self.interpolator.restore()
+            # Capturing, upscaling and the overlay count as flip
+            if self.capture:
+                self.capture.capture(self.canvas)
+            dirty = self.present(dirty)
+            if self.scene == 'play' and self.show_profile and self.profiler:
+                self.draw_profile_overlay()
+            if self.pacer:
+                self.pacer.flip()
+            if dirty is None:
+                pygame.display.flip()
+            else:
+                pygame.display.update(dirty)
+            if self.pacer:
+                self.pacer.flipped()
+            if self.latency_probe:
+                self.latency_probe.on_flip()
+            if prof:
+                prof.lap(PHASE_FLIP)
+                prof.end_frame()
         
+        if self.profile_csv and self.profiler:
+            self.profiler.write_csv(self.profile_csv)
+        if self.recorder:
+            self.recorder.save(self.record_path)
+        if self.capture:
+            self.capture.close()
+            print(f"Captured {self.capture.written} frames to {self.capture.directory}, "
+                  f"dropped {self.capture.dropped}, failed {self.capture.failed}")
+        if self.interpolator and self.late_frames:
+            print(f"{self.late_frames} frames fell behind the simulation "
+                  f"(more than {MAX_FRAME_SKIP} ticks due)")
+        if self.latency_probe:
+            self.latency_probe.stop()
+            print("Input-to-display latency:")
+            print(self.latency_probe.report())
         pygame.quit()
 
 if __name__ == "__main__":
-    game = Game()
-    game.run()
+    parser = argparse.ArgumentParser(description='Super Mario Bros - 32 Levels')
+    parser.add_argument('--profile', action='store_true',
+                        help='start with the frame-time overlay shown (F3 toggles it)')
+    parser.add_argument('--profile-csv', metavar='PATH',
+                        help='record per-phase frame times and write them to PATH at exit')
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help='update only the changed parts of the display each frame')
+    parser.add_argument('--level-cache', metavar='PATH', default=os.environ.get('SMB14K_LEVEL_CACHE'),
+                        help='persist compiled levels to PATH (default: $SMB14K_LEVEL_CACHE)')
+    parser.add_argument('--record', metavar='PATH',
+                        help='record every tick of input to PATH for later replay')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='replay a recording headlessly and check its state hashes')
+    parser.add_argument('--skip-transitions', action='store_true',
+                        help='go straight to the next level or restart without transition screens')
+    parser.add_argument('--render-fps', metavar='N', type=int,
+                        help=f'simulate at a fixed {FPS} ticks/s and draw up to N frames/s '
+                             '(0 for uncapped) with interpolated movement')
+    parser.add_argument('--low-latency', action='store_true',
+                        help='wait before polling input rather than after drawing, to cut input lag')
+    parser.add_argument('--spin-wait', action='store_true',
+                        help='with --low-latency, busy-wait the end of each frame for tighter pacing')
+    parser.add_argument('--latency-probe', action='store_true',
+                        help='measure input-to-display latency and print its distribution at exit')
+    parser.add_argument('--resolution', metavar='WxH', type=lambda s: tuple(map(int, s.split('x'))),
+                        help='draw at this internal resolution (e.g. 256x240) and upscale to the window')
+    parser.add_argument('--upscale', choices=('scale', 'smooth', 'integer'), default='scale',
+                        help='with --resolution: nearest, smooth, or nearest by the largest '
+                             'whole factor that fits, centered')
+    parser.add_argument('--capture', metavar='DIR',
+                        help='save displayed frames to DIR from a background thread; frames '
+                             'are dropped rather than delaying the game when the disk falls behind')
+    parser.add_argument('--capture-every', metavar='N', type=int, default=1,
+                        help='with --capture, keep only every Nth frame')
+    parser.add_argument('--capture-scale', metavar='F', type=float, default=1.0,
+                        help='with --capture, scale frames by F (e.g. 0.5); '
+                             'frames are taken at --resolution when it is given')
+    parser.add_argument('--capture-format', choices=('png', 'raw'), default='png',
+                        help='PNG files, or raw RGB frames appended to DIR/frames.rgb')
+    args = parser.parse_args()
+    if args.level_cache and args.level_cache != level_cache.path:
+        level_cache.open(args.level_cache)
+    if args.replay:
+        start = time.perf_counter()
+        ticks, state_hash = 0, 0
+        try:
+            for ticks, state_hash in replay(args.replay):
+                pass
+        except ReplayDivergence as e:
+            parser.exit(1, f"Replay diverged at {e}\n")
+        elapsed = time.perf_counter() - start
+        print(f"Replayed {ticks} ticks in {elapsed:.2f}s "
+              f"({ticks / max(elapsed, 1e-9):.0f} ticks/s), final state {state_hash:08x}")
+    else:
+        game = Game(profile=args.profile, profile_csv=args.profile_csv, record=args.record,
+                    dirty_rects=args.dirty_rects,
+                    scene_frames=dict.fromkeys(SCENE_FRAMES, 0) if args.skip_transitions else None,
+                    render_fps=args.render_fps, low_latency=args.low_latency,
+                    spin_wait=args.spin_wait, latency_probe=args.latency_probe,
+                    resolution=args.resolution, upscale=args.upscale,
+                    capture=FrameCapture(args.capture, args.capture_every, args.capture_scale,
+                                         args.capture_format) if args.capture else None)
+        game.run()
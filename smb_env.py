@@ -0,0 +1,353 @@
+"""Gym-style vectorized environments over headless smb14k simulations.
+
+VecEnv steps N independent Simulation instances together and returns
+batched NumPy observations:
+
+- 'tiles': (N, VIEW_ROWS, VIEW_COLS) uint8 tile codes for the camera view,
+  built from the generate_level platforms plus coins, enemies, the flag
+  and the player
+- 'state': (N, STATE_SIZE) float32 player state followed by the nearest
+  enemies relative to the player
+- 'pixels' (optional): (N, H, W, 3) uint8 RGB frames, or (N, H, W) uint8
+  luminance with grayscale=True
+
+Actions are INPUT_* bitmasks (0-15). With workers > 0 the instances are
+split across that many worker processes, so simulation throughput scales
+with the cores of a CPU-only machine.
+
+In-process observation arrays are reused: each step overwrites the arrays
+returned by the previous one, so copy anything that must be kept.
+"""
+import multiprocessing
+
+import numpy as np
+import pygame
+
+from smb14k import (FPS, SCREEN_HEIGHT, SCREEN_WIDTH, STATIC_PLATFORM_TYPES, TILE_SIZE,
+                    Renderer, Simulation)
+
+NUM_ACTIONS = 16
+
+# Tile codes used in the 'tiles' observation
+TILE_EMPTY = 0
+TILE_SOLID = 1  # Ground, pipe and castle blocks
+TILE_BRICK = 2
+TILE_QUESTION = 3
+TILE_USED = 4  # Question block that has been hit
+TILE_LAVA = 5
+TILE_COIN = 6
+TILE_ENEMY = 7
+TILE_FLAG = 8
+TILE_PLAYER = 9
+
+VIEW_COLS = SCREEN_WIDTH // TILE_SIZE
+VIEW_ROWS = -(-SCREEN_HEIGHT // TILE_SIZE)
+
+NEAREST_ENEMIES = 8
+PLAYER_STATE_SIZE = 9
+STATE_SIZE = PLAYER_STATE_SIZE + 4 * NEAREST_ENEMIES
+
+ALL_LEVELS = [(world, level) for world in range(1, 9) for level in range(1, 5)]
+
+def platform_code(platform):
+    if platform.platform_type == 'lava':
+        return TILE_LAVA
+    elif platform.platform_type == 'brick':
+        return TILE_BRICK
+    elif platform.platform_type == 'question':
+        return TILE_QUESTION if platform.has_item else TILE_USED
+    return TILE_SOLID
+
+def fill_rect(grid, rect, code, x0=0):
+    """Mark the tiles of grid covered by rect (level coordinates) with code"""
+    rows, cols = grid.shape
+    c0 = max(0, (rect.left - x0) // TILE_SIZE)
+    c1 = min(cols, (rect.right - 1 - x0) // TILE_SIZE + 1)
+    r0 = max(0, rect.top // TILE_SIZE)
+    r1 = min(rows, (rect.bottom - 1) // TILE_SIZE + 1)
+    if c0 < c1 and r0 < r1:
+        grid[r0:r1, c0:c1] = code
+
+def static_tile_grid(sim):
+    """Tile codes of the platforms that never change, for the whole level"""
+    cols = -(-sim.camera.width // TILE_SIZE) + VIEW_COLS
+    grid = np.zeros((VIEW_ROWS, cols), dtype=np.uint8)
+    for platform in sim.platforms:
+        if platform.platform_type in STATIC_PLATFORM_TYPES:
+            fill_rect(grid, platform.rect, platform_code(platform))
+    return grid
+
+def observation_arrays(count=None, pixels=None, grayscale=False):
+    """Allocate zeroed observation arrays, with a leading batch axis if count is set"""
+    lead = () if count is None else (count,)
+    arrays = {'tiles': np.zeros(lead + (VIEW_ROWS, VIEW_COLS), dtype=np.uint8),
+              'state': np.zeros(lead + (STATE_SIZE,), dtype=np.float32)}
+    if pixels:
+        width, height = pixels
+        shape = (height, width) if grayscale else (height, width, 3)
+        arrays['pixels'] = np.zeros(lead + shape, dtype=np.uint8)
+    return arrays
+
+class PixelObserver:
+    """Renders a simulation straight into a small NumPy-backed surface.
+
+    The render target is created with pygame.image.frombuffer over an RGB
+    array, so the world is drawn at the observation resolution and the
+    frame is read without copying or locking the surface. Grayscale frames
+    are an integer luminance pass over that small RGB frame.
+    """
+
+    def __init__(self, width=84, height=84, grayscale=False, out=None):
+        if out is None:
+            shape = (height, width) if grayscale else (height, width, 3)
+            out = np.zeros(shape, dtype=np.uint8)
+        self.out = out
+        self.grayscale = grayscale
+        if grayscale:
+            self.rgb = np.zeros((height, width, 3), dtype=np.uint8)
+            self.luma = np.zeros((height, width), dtype=np.uint16)
+            self.channel = np.zeros((height, width), dtype=np.uint16)
+        else:
+            self.rgb = out
+        self.renderer = Renderer(pygame.image.frombuffer(self.rgb, (width, height), 'RGB'))
+
+    def render(self, sim):
+        self.renderer.draw_world(sim)
+        if not self.grayscale:
+            return self.out
+        # ITU-R BT.601 weights scaled to 256
+        luma, channel, rgb = self.luma, self.channel, self.rgb
+        np.multiply(rgb[..., 0], 77, out=luma, dtype=np.uint16)
+        np.multiply(rgb[..., 1], 150, out=channel, dtype=np.uint16)
+        luma += channel
+        np.multiply(rgb[..., 2], 29, out=channel, dtype=np.uint16)
+        luma += channel
+        np.right_shift(luma, 8, out=self.out, casting='unsafe')
+        return self.out
+
+class SmbEnv:
+    """One headless game instance that plays a single life per episode.
+
+    Reward is forward progress in tiles beyond the best x reached so far,
+    plus score gained / 100, +10 for finishing the level and -5 for losing
+    a life. An episode ends on level completion, a lost life or max_ticks.
+    Observations are written into the arrays of out (see
+    observation_arrays), which may be views into a larger batch.
+    """
+
+    def __init__(self, levels=None, max_ticks=400 * FPS, seed=None,
+                 pixels=None, grayscale=False, out=None):
+        self.levels = list(levels or ALL_LEVELS)
+        self.max_ticks = max_ticks
+        self.rng = np.random.default_rng(seed)
+        self.obs = out if out is not None else observation_arrays(None, pixels, grayscale)
+        self.pixels = None
+        if pixels:
+            self.pixels = PixelObserver(*pixels, grayscale=grayscale, out=self.obs['pixels'])
+        self.sim = None
+        self.static = None  # (CompiledLevel, static tile grid)
+
+    def reset(self):
+        world, level = self.levels[self.rng.integers(len(self.levels))]
+        if self.sim is None:
+            self.sim = Simulation(world, level)
+        else:
+            self.sim.start_world = world
+            self.sim.start_level = level
+            self.sim.reset()
+        self.episode_ticks = 0
+        self.best_x = self.sim.player.rect.x
+        self.last_score = self.sim.score
+        return self.observe()
+
+    def step(self, action):
+        """Returns (obs, reward, done, info); finished episodes reset themselves"""
+        sim = self.sim
+        player = sim.player
+        sim.step(int(action))
+        self.episode_ticks += 1
+
+        reward = (sim.score - self.last_score) / 100
+        self.last_score = sim.score
+        # load_level creates a fresh Player, so a new object means a lost life
+        died = sim.player is not player or sim.game_over
+        completed = sim.level_completed or sim.game_won
+        if completed:
+            reward += 10
+        elif died:
+            reward -= 5
+        else:
+            x = sim.player.rect.x
+            if x > self.best_x:
+                reward += (x - self.best_x) / TILE_SIZE
+                self.best_x = x
+
+        info = {'world': sim.current_world, 'level': sim.current_level,
+                'score': sim.score, 'x': sim.player.rect.x,
+                'completed': completed, 'died': died}
+        done = completed or died or self.episode_ticks >= self.max_ticks
+        if done:
+            info['terminal_observation'] = {key: value.copy()
+                                            for key, value in self.observe().items()}
+            self.reset()
+        else:
+            self.observe()
+        return self.obs, reward, done, info
+
+    def observe(self):
+        sim = self.sim
+        tiles = self.obs['tiles']
+        state = self.obs['state']
+
+        view = sim.camera.view
+        col = view.x // TILE_SIZE
+        x0 = col * TILE_SIZE
+        streamed = sim.stream is not None
+        if streamed:
+            # A streamed level has no whole-level grid; static platforms are drawn below
+            tiles[:] = TILE_EMPTY
+        else:
+            if self.static is None or self.static[0] is not sim.compiled_level:
+                self.static = (sim.compiled_level, static_tile_grid(sim))
+            tiles[:] = self.static[1][:, col:col + VIEW_COLS]
+        for platform in sim.platforms.query(view):
+            if not streamed and platform.platform_type in STATIC_PLATFORM_TYPES:
+                continue
+            if platform.tiles is None:
+                fill_rect(tiles, platform.rect, platform_code(platform), x0)
+            else:
+                rect = platform.rect
+                width = platform.tile_width
+                for i in platform.intact_tiles(view):
+                    tile = pygame.Rect(rect.x + i * width, rect.y, width, rect.height)
+                    fill_rect(tiles, tile, platform_code(platform), x0)
+        for coin in sim.coins.query(view):
+            fill_rect(tiles, coin.rect, TILE_COIN, x0)
+        for enemy in sim.enemies:
+            if enemy.rect.colliderect(view):
+                fill_rect(tiles, enemy.rect, TILE_ENEMY, x0)
+        fill_rect(tiles, sim.flag.rect, TILE_FLAG, x0)
+        fill_rect(tiles, sim.player.rect, TILE_PLAYER, x0)
+
+        player = sim.player
+        state[:PLAYER_STATE_SIZE] = (
+            player.rect.x / TILE_SIZE, player.rect.y / TILE_SIZE,
+            player.vel_x, player.vel_y, player.on_ground,
+            sim.timer / sim.time_limit, view.x / TILE_SIZE,
+            sim.current_world, sim.current_level)
+        nearest = sorted(sim.enemies,
+                         key=lambda e: abs(e.rect.centerx - player.rect.centerx))
+        state[PLAYER_STATE_SIZE:] = 0
+        for i, enemy in enumerate(nearest[:NEAREST_ENEMIES]):
+            j = PLAYER_STATE_SIZE + 4 * i
+            state[j:j + 4] = ((enemy.rect.x - player.rect.x) / TILE_SIZE,
+                              (enemy.rect.y - player.rect.y) / TILE_SIZE,
+                              enemy.vel_x, 1.0)
+
+        if self.pixels:
+            self.pixels.render(sim)
+        return self.obs
+
+class _EnvBatch:
+    """A slice of environments that write straight into shared batch arrays"""
+
+    def __init__(self, count, levels, max_ticks, seed, pixels, grayscale):
+        self.obs = observation_arrays(count, pixels, grayscale)
+        self.envs = [SmbEnv(levels, max_ticks, None if seed is None else seed + i,
+                            pixels, grayscale,
+                            out={key: array[i] for key, array in self.obs.items()})
+                     for i in range(count)]
+        self.rewards = np.zeros(count, dtype=np.float32)
+        self.dones = np.zeros(count, dtype=bool)
+
+    def reset(self):
+        for env in self.envs:
+            env.reset()
+        return self.obs
+
+    def step(self, actions):
+        infos = []
+        for i, env in enumerate(self.envs):
+            _, self.rewards[i], self.dones[i], info = env.step(actions[i])
+            infos.append(info)
+        return self.obs, self.rewards, self.dones, infos
+
+def _worker(conn, *batch_args):
+    batch = _EnvBatch(*batch_args)
+    while True:
+        command, data = conn.recv()
+        if command == 'step':
+            conn.send(batch.step(data))
+        elif command == 'reset':
+            conn.send(batch.reset())
+        elif command == 'close':
+            conn.close()
+            return
+
+class VecEnv:
+    """N independent SmbEnv instances with batched reset()/step().
+
+    Finished environments reset automatically; their last observation is
+    in info['terminal_observation']. With workers > 0 the environments are
+    spread over that many processes. pixels=(width, height) adds rendered
+    frames at that resolution to the observations.
+    """
+
+    def __init__(self, num_envs, levels=None, workers=0, max_ticks=400 * FPS, seed=None,
+                 pixels=None, grayscale=False):
+        self.num_envs = num_envs
+        self.workers = []
+        if workers <= 0:
+            self.batch = _EnvBatch(num_envs, levels, max_ticks, seed, pixels, grayscale)
+            return
+        self.batch = None
+        self.slices = []
+        workers = min(workers, num_envs)
+        start = 0
+        for w in range(workers):
+            count = num_envs // workers + (w < num_envs % workers)
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_worker, daemon=True,
+                args=(child, count, levels, max_ticks, None if seed is None else seed + start,
+                      pixels, grayscale))
+            process.start()
+            child.close()
+            self.workers.append((parent, process))
+            self.slices.append(slice(start, start + count))
+            start += count
+
+    def reset(self):
+        """Return the initial observation batch"""
+        if self.batch is not None:
+            return self.batch.reset()
+        for conn, _ in self.workers:
+            conn.send(('reset', None))
+        replies = [conn.recv() for conn, _ in self.workers]
+        return {key: np.concatenate([obs[key] for obs in replies]) for key in replies[0]}
+
+    def step(self, actions):
+        """Advance every environment one tick; returns (obs, rewards, dones, infos)"""
+        actions = np.asarray(actions, dtype=np.int64)
+        if self.batch is not None:
+            return self.batch.step(actions)
+        for (conn, _), part in zip(self.workers, self.slices):
+            conn.send(('step', actions[part]))
+        replies = [conn.recv() for conn, _ in self.workers]
+        obs = {key: np.concatenate([reply[0][key] for reply in replies]) for key in replies[0][0]}
+        rewards = np.concatenate([reply[1] for reply in replies])
+        dones = np.concatenate([reply[2] for reply in replies])
+        infos = [info for reply in replies for info in reply[3]]
+        return obs, rewards, dones, infos
+
+    def close(self):
+        for conn, process in self.workers:
+            conn.send(('close', None))
+            process.join()
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
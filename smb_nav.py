@@ -0,0 +1,238 @@
+"""Jump/walk reachability graphs for smb14k levels.
+
+level_graph(world, level) reduces a compiled level to its standable
+surfaces (platform tops not covered by another platform, lava excluded)
+and links surface A to surface B when a jump from A can land on B. The
+jump is the player's highest, fastest one, traced once by stepping a real
+Player, so it follows Player's jump_power, gravity, max_speed,
+acceleration and friction exactly:
+
+    graph = level_graph(1, 1)
+    graph.flag_reachable()        # True
+    graph.path(graph.start, 12)   # [8, 2, 12], surface indices
+
+The graph is optimistic: it assumes a running start, full air control and
+no ceilings, and lets a falling player land wherever its rect overlaps a
+platform, as Simulation.handle_collisions does. An unreachable flag is a
+broken level; a reachable one may still need a precise run. Edge weights
+are the ticks spent in the air, so path() returns the route with the
+least airtime.
+
+Run as a script to check that the flag of every level is reachable.
+"""
+import argparse
+import heapq
+import time
+from bisect import bisect_left, bisect_right
+
+from smb14k import (PLATFORM_TYPES, SCREEN_HEIGHT, TILE_SIZE, Flag, Player, level_cache)
+
+PLAYER_START = (TILE_SIZE * 2, SCREEN_HEIGHT - TILE_SIZE * 4)
+
+def jump_arc():
+    """(dx, dy, vel_y) after each tick of a held jump at full speed, from standing at (0, 0)"""
+    player = Player(0, 0)
+    player.on_ground = True
+    player.vel_x = player.max_speed
+    player.jump()
+    arc = []
+    # Follow the fall until it has dropped past anything on screen
+    while player.rect.y <= SCREEN_HEIGHT * 2:
+        player.move_right()
+        if player.vel_y < -5:
+            player.vel_y -= 0.5  # Jump held, as in Simulation.step
+        player.update()
+        arc.append((player.rect.x, player.rect.y, player.vel_y))
+    return arc
+
+class NavGraph:
+    """Standable surfaces of one level and the jumps between them.
+
+    surfaces holds (left, right, top, bottom) per surface, bottom being the
+    lowest edge of the platforms under it. edges[i] maps each surface
+    reachable from surface i to the airborne ticks of the jump. start is the
+    surface the player spawns onto (None if it falls straight into a pit)
+    and flag maps the surfaces from which the flag can be touched to the
+    ticks that takes.
+    """
+
+    def __init__(self, surfaces, edges, start, flag):
+        self.surfaces = surfaces
+        self.edges = edges
+        self.start = start
+        self.flag = flag
+
+    def reachable(self, source=None):
+        """Indices of the surfaces reachable from source (default: the start)"""
+        source = self.start if source is None else source
+        if source is None:
+            return set()
+        seen = {source}
+        todo = [source]
+        while todo:
+            for target in self.edges[todo.pop()]:
+                if target not in seen:
+                    seen.add(target)
+                    todo.append(target)
+        return seen
+
+    def path(self, source, target):
+        """Surface indices from source to target with the least airtime, or None"""
+        if source is None:
+            return None
+        best = {source: 0}
+        previous = {}
+        heap = [(0, source)]
+        while heap:
+            ticks, node = heapq.heappop(heap)
+            if node == target:
+                route = [node]
+                while node in previous:
+                    node = previous[node]
+                    route.append(node)
+                return route[::-1]
+            if ticks > best[node]:
+                continue
+            for nxt, cost in self.edges[node].items():
+                if ticks + cost < best.get(nxt, float('inf')):
+                    best[nxt] = ticks + cost
+                    previous[nxt] = node
+                    heapq.heappush(heap, (ticks + cost, nxt))
+        return None
+
+    def flag_reachable(self):
+        return not self.reachable().isdisjoint(self.flag)
+
+    def flag_path(self):
+        """Surfaces from the start to one the flag can be touched from, or None"""
+        routes = [self.path(self.start, surface) for surface in self.flag]
+        routes = [route for route in routes if route]
+        return min(routes, key=len) if routes else None
+
+    def surface_at(self, x, y):
+        """Index of the surface a player at (x, y) would land on falling straight down, or None.
+
+        As in the game, a falling player that overlaps a platform is put on
+        top of it, so this is the highest surface below or around the player.
+        """
+        width = Player(0, 0).width
+        best = None
+        for i, (left, right, top, bottom) in enumerate(self.surfaces):
+            if left < x + width and x < right and bottom > y:
+                if best is None or top < self.surfaces[best][2]:
+                    best = i
+        return best
+
+def standable_surfaces(platforms):
+    """Merge uncovered platform tops into (left, right, top, bottom) surfaces"""
+    rects = [(PLATFORM_TYPES[platforms[i]],) + tuple(platforms[i + 1:i + 5])
+             for i in range(0, len(platforms), 6)]
+    tops = {}
+    for kind, x, y, w, h in rects:
+        if kind != 'lava':
+            tops.setdefault(y, []).append((x, x + w, y + h))
+    surfaces = []
+    for top, spans in sorted(tops.items()):
+        # Parts of the top edge with another platform sitting on them
+        covered = sorted((x, x + w) for kind, x, y, w, h in rects if y < top <= y + h)
+        for left, right, bottom in sorted(spans):
+            pieces = [(left, right)]
+            for cover_left, cover_right in covered:
+                pieces = [piece for l, r in pieces for piece in
+                          ((l, min(r, cover_left)), (max(l, cover_right), r)) if piece[0] < piece[1]]
+            for l, r in pieces:
+                last = surfaces[-1] if surfaces else None
+                if last and last[2] == top and last[1] >= l:
+                    surfaces[-1] = (last[0], max(last[1], r), top, max(last[3], bottom))
+                else:
+                    surfaces.append((l, r, top, bottom))
+    return surfaces
+
+def build_graph(compiled):
+    surfaces = standable_surfaces(compiled.platforms)
+    arc = jump_arc()
+    player = Player(0, 0)
+    width, height = player.width, player.height
+
+    # Landing needs a falling player; on the way down dx and dy only grow
+    falling = [(tick + 1, dx, dy) for tick, (dx, dy, vel_y) in enumerate(arc) if vel_y > 0]
+    fall_ticks = [tick for tick, dx, dy in falling]
+    fall_dx = [dx for tick, dx, dy in falling]
+    fall_dy = [dy for tick, dx, dy in falling]
+    reach = fall_dx[-1]
+
+    # Player left edges that keep it on each surface
+    spans = [(left - width + 1, right - 1) for left, right, top, bottom in surfaces]
+    order = sorted(range(len(surfaces)), key=lambda i: spans[i][0])
+    edges = [{} for _ in surfaces]
+    for a, (a_left, a_right) in enumerate(spans):
+        a_top = surfaces[a][2]
+        for b in order:
+            b_left, b_right = spans[b]
+            if b_left - a_right > reach:
+                break
+            if b == a or a_left - b_right > reach:
+                continue
+            b_top, b_bottom = surfaces[b][2], surfaces[b][3]
+            # Ticks while the player's rect overlaps B vertically
+            first = bisect_right(fall_dy, b_top - a_top)
+            last = bisect_left(fall_dy, b_bottom + height - a_top) - 1
+            if first > last:
+                continue
+            gap = max(0, b_left - a_right, a_left - b_right)
+            if fall_dx[last] < gap:
+                continue
+            edges[a][b] = fall_ticks[max(first, bisect_left(fall_dx, gap))]
+
+    # The flag counts on contact at any point of a jump, or just standing by it
+    flag = {}
+    flag_x, flag_y = compiled.flag_pos
+    flag_rect = Flag(flag_x, flag_y).rect
+    flag_left, flag_right = flag_rect.left - width + 1, flag_rect.right - 1
+    for a, (a_left, a_right) in enumerate(spans):
+        a_top = surfaces[a][2]
+        gap = max(0, flag_left - a_right, a_left - flag_right)
+        for tick, (dx, dy, vel_y) in enumerate([(0, 0, 0)] + arc):
+            bottom = a_top + dy
+            if dx >= gap and bottom > flag_rect.top and bottom - height < flag_rect.bottom:
+                flag[a] = tick
+                break
+
+    start = NavGraph(surfaces, edges, None, flag).surface_at(*PLAYER_START)
+    return NavGraph(surfaces, edges, start, flag)
+
+# Graphs by (world, level, width_scale); enemies do not change the geometry
+nav_cache = {}
+
+def level_graph(world, level, width_scale=1):
+    key = (world, level, width_scale)
+    graph = nav_cache.get(key)
+    if graph is None:
+        graph = nav_cache[key] = build_graph(level_cache.get(world, level, width_scale))
+    return graph
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that every level flag is reachable')
+    parser.add_argument('--width-scale', type=int, default=1,
+                        help='check levels generated this many times wider')
+    args = parser.parse_args()
+    levels = [(world, level) for world in range(1, 9) for level in range(1, 5)]
+    for world, level in levels:
+        level_cache.get(world, level, args.width_scale)  # Generation is not part of the check
+    start = time.perf_counter()
+    broken = []
+    for world, level in levels:
+        graph = level_graph(world, level, args.width_scale)
+        route = graph.flag_path()
+        if route:
+            # The jumps between surfaces, plus the last one to the flag unless it is touched standing
+            jumps = len(route) - 1 + (graph.flag[route[-1]] > 0)
+        print(f"{world}-{level}: {len(graph.surfaces):4d} surfaces "
+              f"{sum(map(len, graph.edges)):6d} jumps  "
+              + (f"flag in {jumps} jumps" if route else "FLAG UNREACHABLE"))
+        if not route:
+            broken.append(f"{world}-{level}")
+    elapsed = time.perf_counter() - start
+    print(f"Checked {len(levels)} levels in {elapsed * 1000:.1f} ms")
+    if broken:
+        parser.exit(1, f"Unreachable flags: {', '.join(broken)}\n")